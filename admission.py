@@ -0,0 +1,246 @@
+from metrics import ROUTER_QUEUE_DEPTH, ROUTER_QUEUE_WAIT, ROUTER_IN_FLIGHT, ERRORS
+from collections import deque
+from contextlib import contextmanager
+import asyncio, math, threading, time
+
+# Controle de admissão na frente da API de cada roteador: no máximo `max_in_flight`
+# operações em andamento por roteador; as demais esperam em uma fila limitada, por
+# prioridade (remoções e expirações primeiro, depois liberações, depois consultas),
+# para que rajadas de /add_mac ou de expirações não saturem a CPU da API do MikroTik
+# e o login do hotspot continue sendo atendido.
+#
+# Sobrecarga falha rápido e de forma previsível: com a fila cheia, a operação nova
+# toma o lugar da mais recente de prioridade menor, ou é recusada (QueueFull -> 429);
+# uma operação cujo prazo vence na fila é descartada sem chegar ao roteador
+# (QueueTimeout -> 503). As duas trazem uma estimativa de Retry-After.
+
+REMOVE, ADD, READ = 0, 1, 2
+PRIORITY_NAMES = {REMOVE: 'remove', ADD: 'add', READ: 'read'}
+
+
+class AdmissionError(Exception):
+    status = 503
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFull(AdmissionError):
+    status = 429
+
+
+class QueueTimeout(AdmissionError):
+    status = 503
+
+
+class _Waiter:
+    def __init__(self, priority, deadline, wakeup):
+        self.priority = priority
+        self.deadline = deadline
+        self.wakeup = wakeup   # threading.Event ou asyncio.Future
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.error = None
+
+
+# Acordam o waiter que recebeu a vaga (ou um erro) na versão com threads e na assíncrona
+def _set_event(waiter):
+    waiter.wakeup.set()
+
+
+def _resolve_future(waiter):
+    if not waiter.wakeup.done():
+        waiter.wakeup.set_result(None)
+
+
+# Lógica comum às versões com threads e asyncio; os métodos são chamados com o
+# estado protegido (lock na versão com threads, loop único na assíncrona). `wake`
+# acorda um waiter (_set_event ou _resolve_future).
+class _AdmissionQueue:
+    def __init__(self, name, wake, max_in_flight=4, max_queue=100, max_wait=5.0):
+        self.name = name
+        self._wake = wake
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._queues = {priority: deque() for priority in PRIORITY_NAMES}
+        self._in_flight = 0
+        self._service_time = 0.05   # média móvel da duração das operações, para o Retry-After
+        self._stats = {'admitted': 0, 'queued': 0, 'rejected': 0, 'evicted': 0, 'expired': 0}
+        self._publish()
+
+    def _queued(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _publish(self):
+        for priority, queue in self._queues.items():
+            ROUTER_QUEUE_DEPTH.set(len(queue), router=self.name, priority=PRIORITY_NAMES[priority])
+        ROUTER_IN_FLIGHT.set(self._in_flight, router=self.name)
+
+    # Segundos até haver vaga, estimados pelo que está na fila e em andamento
+    def retry_after(self):
+        backlog = self._queued() + self._in_flight
+        return max(1, math.ceil(backlog * self._service_time / self.max_in_flight))
+
+    def _rejection(self):
+        self._stats['rejected'] += 1
+        ERRORS.inc(kind='admission_rejected')
+        return QueueFull(f"Fila do roteador {self.name} cheia; tente novamente mais tarde.", self.retry_after())
+
+    def _expiration(self):
+        self._stats['expired'] += 1
+        ERRORS.inc(kind='admission_expired')
+        return QueueTimeout(f"Roteador {self.name} sobrecarregado: prazo esgotado na fila.", self.retry_after())
+
+    def _can_start(self):
+        return self._in_flight < self.max_in_flight and not self._queued()
+
+    def _admit(self, priority, waited):
+        self._in_flight += 1
+        self._stats['admitted'] += 1
+        ROUTER_QUEUE_WAIT.observe(waited, router=self.name, priority=PRIORITY_NAMES[priority])
+        self._publish()
+
+    # Põe o waiter na fila; com a fila cheia, desaloja o mais recente de prioridade
+    # menor ou lança QueueFull
+    def _enqueue(self, waiter):
+        if self._queued() >= self.max_queue:
+            lowest = max((priority for priority, queue in self._queues.items() if queue), default=None)
+            if lowest is None or lowest <= waiter.priority:
+                raise self._rejection()
+            evicted = self._queues[lowest].pop()
+            evicted.error = self._rejection()
+            self._stats['evicted'] += 1
+            self._wake(evicted)
+        self._queues[waiter.priority].append(waiter)
+        self._stats['queued'] += 1
+        self._publish()
+
+    def _withdraw(self, waiter):
+        try:
+            self._queues[waiter.priority].remove(waiter)
+        except ValueError:
+            pass
+        self._publish()
+
+    # Libera vagas para os próximos da fila, descartando os que perderam o prazo
+    def _grant_next(self):
+        now = time.monotonic()
+        while self._in_flight < self.max_in_flight:
+            queue = next((queue for queue in self._queues.values() if queue), None)
+            if queue is None:
+                break
+            waiter = queue.popleft()
+            if waiter.deadline <= now:
+                waiter.error = self._expiration()
+            else:
+                waiter.granted = True
+                self._admit(waiter.priority, now - waiter.enqueued_at)
+            self._wake(waiter)
+        self._publish()
+
+    def _finish(self, seconds):
+        self._in_flight -= 1
+        self._service_time += 0.2 * (seconds - self._service_time)
+        self._grant_next()
+
+    def _snapshot(self):
+        stats = dict(self._stats)
+        stats.update({
+            'in_flight': self._in_flight,
+            'max_in_flight': self.max_in_flight,
+            'queued': {PRIORITY_NAMES[priority]: len(queue) for priority, queue in self._queues.items()},
+            'max_queue': self.max_queue,
+            'service_time_avg': self._service_time,
+        })
+        return stats
+
+
+# Versão com threads (servidor Flask). Uso:
+#   with gateway.admission.slot(REMOVE): ...
+class AdmissionQueue(_AdmissionQueue):
+    def __init__(self, name, max_in_flight=4, max_queue=100, max_wait=5.0):
+        self._lock = threading.Lock()
+        super().__init__(name, _set_event, max_in_flight, max_queue, max_wait)
+
+    @contextmanager
+    def slot(self, priority, timeout=None):
+        self._acquire(priority, self.max_wait if timeout is None else timeout)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._finish(time.monotonic() - started)
+
+    def _acquire(self, priority, timeout):
+        with self._lock:
+            if self._can_start():
+                self._admit(priority, 0.0)
+                return
+            waiter = _Waiter(priority, time.monotonic() + timeout, threading.Event())
+            self._enqueue(waiter)
+        waiter.wakeup.wait(timeout)
+        with self._lock:
+            if not waiter.granted and waiter.error is None:
+                # prazo vencido na fila: sai sem ter chegado ao roteador
+                self._withdraw(waiter)
+                waiter.error = self._expiration()
+        if waiter.error is not None:
+            raise waiter.error
+
+    def stats(self):
+        with self._lock:
+            return self._snapshot()
+
+
+# Versão assíncrona (servidor_async); usada só dentro do loop. Uso:
+#   async with gateway.admission.slot(ADD): ...
+class AsyncAdmissionQueue(_AdmissionQueue):
+    def __init__(self, name, max_in_flight=4, max_queue=100, max_wait=5.0):
+        super().__init__(name, _resolve_future, max_in_flight, max_queue, max_wait)
+
+    def slot(self, priority, timeout=None):
+        return _AsyncSlot(self, priority, self.max_wait if timeout is None else timeout)
+
+    async def _acquire(self, priority, timeout):
+        if self._can_start():
+            self._admit(priority, 0.0)
+            return
+        waiter = _Waiter(priority, time.monotonic() + timeout, asyncio.get_running_loop().create_future())
+        self._enqueue(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.wakeup), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # requisição encerrada enquanto esperava (ex: REQUEST_TIMEOUT)
+            if waiter.granted:
+                self._finish(0.0)
+            else:
+                self._withdraw(waiter)
+            raise
+        if not waiter.granted and waiter.error is None:
+            self._withdraw(waiter)
+            waiter.error = self._expiration()
+        if waiter.error is not None:
+            raise waiter.error
+
+    def stats(self):
+        return self._snapshot()
+
+
+class _AsyncSlot:
+    def __init__(self, queue, priority, timeout):
+        self.queue = queue
+        self.priority = priority
+        self.timeout = timeout
+        self.started = None
+
+    async def __aenter__(self):
+        await self.queue._acquire(self.priority, self.timeout)
+        self.started = time.monotonic()
+
+    async def __aexit__(self, *exc_info):
+        self.queue._finish(time.monotonic() - self.started)
@@ -0,0 +1,294 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib import request as urlrequest, error as urlerror
+import argparse, json, os, subprocess, sys, tempfile, threading, time
+
+from simulador_routeros import RouterOSSimulator
+
+# Mede vazão e latência de um servidor (Flask ou servidor_async) disparando
+# requisições concorrentes. Exemplo, comparando os dois modos:
+#   python liberaçãomikrotik.py          &  python bench_concorrencia.py --url http://127.0.0.1:5000
+#   uvicorn servidor_async:app --port 5001 & python bench_concorrencia.py --url http://127.0.0.1:5001
+#
+# Com --server, o próprio benchmark sobe o simulador do RouterOS (simulador_routeros.py)
+# e o servidor escolhido apontando para ele, e também informa os comandos enviados ao
+# roteador por operação e o pico de threads e sockets do processo do servidor:
+#   python bench_concorrencia.py --server async --latency 0.005 --bindings 5000 \
+#       --endpoint /add_mac /remove_mac --output resultados.json --compare base.json
+
+SERVER_COMMANDS = {
+    'flask': [sys.executable, '-m', 'flask', '--app', 'liberaçãomikrotik', 'run',
+              '--host', '127.0.0.1', '--port', '{port}', '--no-reload', '--no-debugger'],
+    'async': [sys.executable, '-m', 'uvicorn', 'servidor_async:app',
+              '--host', '127.0.0.1', '--port', '{port}', '--log-level', 'warning'],
+}
+
+
+# MAC único por requisição, para que cada /add_mac seja uma inclusão nova
+def mac_for(index, prefix=0x02):
+    value = (prefix << 40) | index
+    return ':'.join(f'{(value >> shift) & 0xFF:02X}' for shift in range(40, -1, -8))
+
+
+def body_for(endpoint, index, duration):
+    if endpoint == '/add_mac':
+        return {'mac_address': mac_for(index), 'duration': duration}
+    if endpoint == '/remove_mac':
+        return {'mac_address': mac_for(index)}
+    if endpoint == '/payment-notification':
+        return {'action': 'payment.updated', 'type': 'payment', 'data': {'id': str(index)}}
+    raise ValueError(f"Endpoint sem corpo de teste: {endpoint}")
+
+
+def post(url, body, timeout):
+    data = json.dumps(body).encode()
+    req = urlrequest.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    started = time.perf_counter()
+    try:
+        with urlrequest.urlopen(req, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urlerror.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 'erro'
+    return status, time.perf_counter() - started
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+# Threads e sockets abertos de um processo (Linux, via /proc); None fora do Linux
+def process_resources(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            threads = next(int(line.split()[1]) for line in f if line.startswith('Threads:'))
+        sockets = 0
+        for fd in os.listdir(f'/proc/{pid}/fd'):
+            try:
+                if os.readlink(f'/proc/{pid}/fd/{fd}').startswith('socket:'):
+                    sockets += 1
+            except OSError:
+                pass
+        return threads, sockets
+    except (OSError, StopIteration):
+        return None
+
+
+# Amostra threads e sockets do servidor durante a carga e guarda o pico
+class ResourceSampler:
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak_threads = None
+        self.peak_sockets = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        resources = process_resources(self.pid)
+        if resources:
+            threads, sockets = resources
+            self.peak_threads = max(self.peak_threads or 0, threads)
+            self.peak_sockets = max(self.peak_sockets or 0, sockets)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        if self.pid:
+            self._sample()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._sample()
+
+
+def run(url, endpoint, concurrency, total, duration=60, timeout=30, offset=0,
+        simulator=None, pid=None):
+    target = url.rstrip('/') + endpoint
+    if simulator:
+        simulator.reset_stats()
+    started = time.perf_counter()
+    with ResourceSampler(pid) as sampler:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(
+                lambda i: post(target, body_for(endpoint, offset + i, duration), timeout),
+                range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for _, latency in results]
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    result = {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': total,
+        'elapsed': elapsed,
+        'throughput': total / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'statuses': statuses,
+        'peak_threads': sampler.peak_threads,
+        'peak_sockets': sampler.peak_sockets,
+    }
+    if simulator:
+        router = simulator.stats()
+        result['router_commands'] = router.get('commands', 0)
+        result['router_commands_per_op'] = router.get('commands', 0) / total if total else 0.0
+        result['router_logins'] = router.get('logins', 0)
+        result['router_by_command'] = router['by_command']
+    return result
+
+
+# Cria (sem medir) os bindings que um /remove_mac vai remover, via /add_macs
+def seed_bindings(url, offset, total, duration, timeout=60, chunk=500):
+    for start in range(offset, offset + total, chunk):
+        entries = [{'mac_address': mac_for(i), 'duration': duration}
+                   for i in range(start, min(offset + total, start + chunk))]
+        status, _ = post(url.rstrip('/') + '/add_macs', {'entries': entries}, timeout)
+        if status != 200:
+            raise RuntimeError(f"Falha ao preparar bindings para /remove_mac: HTTP {status}")
+
+
+# Sobe o servidor escolhido apontando para o simulador, com bancos temporários
+def start_server(kind, port, router_port, data_dir, extra_env=None):
+    env = dict(os.environ)
+    env.pop('ROUTERS_FILE', None)
+    env.update({
+        'HOST': '127.0.0.1', 'PORT': str(router_port), 'USERNAME': 'bench', 'PASSWORD': 'bench',
+        'EXPIRY_DB_PATH': os.path.join(data_dir, 'expiracoes.db'),
+        'PAYMENT_DB_PATH': os.path.join(data_dir, 'pagamentos.db'),
+        'MP_ACCESS_TOKEN': '',
+    })
+    env.update(extra_env or {})
+    command = [part.format(port=port) for part in SERVER_COMMANDS[kind]]
+    process = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Servidor {kind} terminou durante a inicialização")
+        try:
+            with urlrequest.urlopen(url + '/index_stats', timeout=1):
+                return process, url
+        except Exception:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Servidor {kind} não respondeu em 30s")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+# Compara com um arquivo de resultados anterior, pelo par (endpoint, concorrência)
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(item['endpoint'], item['concurrency']): item for item in json.load(f)['results']}
+    for result in results:
+        previous = baseline.get((result['endpoint'], result['concurrency']))
+        if not previous:
+            continue
+        throughput = (result['throughput'] / previous['throughput'] - 1) * 100 if previous['throughput'] else 0.0
+        p99 = (result['p99_ms'] / previous['p99_ms'] - 1) * 100 if previous['p99_ms'] else 0.0
+        print(f"{result['endpoint']} c={result['concurrency']}: vazão {throughput:+.1f}%, p99 {p99:+.1f}% "
+              f"em relação a {baseline_path}")
+
+
+def format_result(result):
+    line = (f"{result['endpoint']} c={result['concurrency']}: {result['throughput']:.1f} req/s, "
+            f"p50={result['p50_ms']:.1f}ms p99={result['p99_ms']:.1f}ms {result['statuses']}")
+    if 'router_commands_per_op' in result:
+        line += f" comandos/op={result['router_commands_per_op']:.2f} logins={result['router_logins']}"
+    if result['peak_threads'] is not None:
+        line += f" threads={result['peak_threads']} sockets={result['peak_sockets']}"
+    return line
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Carga concorrente nos endpoints do serviço')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--endpoint', nargs='+', default=['/add_mac'],
+                        choices=['/add_mac', '/remove_mac', '/payment-notification'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--duration', type=int, default=60, help="'duration' enviado em /add_mac")
+    parser.add_argument('--pid', type=int, help='Processo do servidor, para contar threads e sockets')
+    parser.add_argument('--server', choices=sorted(SERVER_COMMANDS),
+                        help='Sobe este servidor contra o simulador do RouterOS (ignora --url)')
+    parser.add_argument('--port', type=int, default=5099, help='Porta do servidor iniciado com --server')
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulador: atraso por comando (s)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Simulador: atraso aleatório adicional (s)')
+    parser.add_argument('--bindings', type=int, default=0, help='Simulador: entradas pré-carregadas no IP Binding')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Simulador: fração de comandos com !trap')
+    parser.add_argument('--disconnect-rate', type=float, default=0.0,
+                        help='Simulador: fração de comandos que derrubam a conexão')
+    parser.add_argument('--output', help='Grava os resultados neste arquivo JSON')
+    parser.add_argument('--compare', help='Arquivo JSON de uma execução anterior, para comparar')
+    args = parser.parse_args()
+
+    simulator = process = data_dir = None
+    url, pid = args.url, args.pid
+    if args.server:
+        simulator = RouterOSSimulator(
+            latency=args.latency, jitter=args.jitter, bindings=args.bindings,
+            failure_rate=args.failure_rate, disconnect_rate=args.disconnect_rate, seed=0,
+        ).start()
+        data_dir = tempfile.TemporaryDirectory()
+        process, url = start_server(args.server, args.port, simulator.address[1], data_dir.name)
+        pid = process.pid
+
+    results = []
+    try:
+        offset = 0
+        for endpoint in args.endpoint:
+            for concurrency in args.concurrency:
+                if endpoint == '/remove_mac':
+                    seed_bindings(url, offset, args.requests, args.duration)
+                result = run(url, endpoint, concurrency, args.requests, args.duration, offset=offset,
+                             simulator=simulator, pid=pid)
+                offset += args.requests
+                results.append(result)
+                print(format_result(result))
+    finally:
+        if process:
+            process.terminate()
+            process.wait(10)
+        if simulator:
+            simulator.stop()
+        if data_dir:
+            data_dir.cleanup()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'timestamp': time.time(),
+                'revision': git_revision(),
+                'server': args.server,
+                'url': None if args.server else args.url,
+                'simulator': {
+                    'latency': args.latency, 'jitter': args.jitter, 'bindings': args.bindings,
+                    'failure_rate': args.failure_rate, 'disconnect_rate': args.disconnect_rate,
+                } if args.server else None,
+                'requests': args.requests,
+                'results': results,
+            }, f, indent=2)
+        print(f"Resultados gravados em {args.output}")
+    if args.compare:
+        compare(results, args.compare)
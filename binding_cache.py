@@ -0,0 +1,266 @@
+from binding_index import BINDING_PATH, normalize_mac
+from routeros_pipeline import parse_words
+import asyncio, logging, select, threading, time
+
+log = logging.getLogger(__name__)
+
+# Cópia local de /ip/hotspot/ip-binding mantida pelo fluxo de mudanças do RouterOS.
+#
+# Um seguidor (thread no servidor Flask, tarefa no servidor assíncrono) abre uma
+# sessão própria, inicia o `listen` do menu e só então pede o print completo: as
+# mudanças que chegam antes do fim do print ficam guardadas e são aplicadas depois
+# dele, sem janela em que uma mudança se perca. Se a sessão cai, a cópia é marcada
+# como não sincronizada e o seguidor reconecta e recarrega. O mesmo fluxo mantém o
+# índice MAC -> .id (binding_index.BindingIndex) exato.
+
+LISTEN_TAG = 'listen'
+SNAPSHOT_TAG = 'snapshot'
+PING_TAG = 'ping'
+
+
+def _is_dead(row):
+    return row.get('.dead') in (True, 'true', 'yes')  # parse_word já converte 'true'
+
+
+def _mac_of(row):
+    try:
+        return normalize_mac(row.get('mac-address'))
+    except ValueError:
+        return None  # entradas por IP, sem MAC
+
+
+class BindingCache:
+    def __init__(self):
+        self._rows = {}   # .id -> linha, na ordem do roteador
+        self._lock = threading.Lock()
+        self._synced = False
+        self._synced_at = None
+        self._stats = {'snapshots': 0, 'events': 0, 'resyncs': 0}
+
+    @property
+    def synced(self):
+        return self._synced
+
+    # Substitui a cópia pelas linhas de um print completo
+    def replace(self, rows):
+        with self._lock:
+            self._rows = {row['.id']: dict(row) for row in rows if '.id' in row}
+            self._synced = True
+            self._synced_at = time.time()
+            self._stats['snapshots'] += 1
+
+    # Aplica uma mudança do listen. Retorna (mac, .id) da entrada afetada, com .id
+    # None quando a entrada foi removida.
+    def apply(self, row):
+        binding_id = row.get('.id')
+        if not binding_id:
+            return None, None
+        with self._lock:
+            self._stats['events'] += 1
+            if _is_dead(row):
+                removed = self._rows.pop(binding_id, None) or {}
+                return _mac_of(removed), None
+            # linha nova em vez de alterar a atual, que pode estar sendo lida por select()
+            current = self._rows[binding_id] = {**self._rows.get(binding_id, {}), **row}
+            return _mac_of(current), binding_id
+
+    def mark_unsynced(self):
+        with self._lock:
+            if self._synced:
+                self._stats['resyncs'] += 1
+            self._synced = False
+
+    # Linhas filtradas por MAC (exato) e/ou comentário (trecho, sem diferenciar
+    # maiúsculas), copiadas uma a uma conforme são consumidas. Percorre as linhas do
+    # momento da chamada: só as referências são guardadas, não cópias.
+    def select(self, mac_address=None, comment=None):
+        mac = normalize_mac(mac_address) if mac_address else None
+        comment = comment.lower() if comment else None
+        with self._lock:
+            rows = list(self._rows.values())
+        for row in rows:
+            if (mac is None or _mac_of(row) == mac) and (comment is None or comment in row.get('comment', '').lower()):
+                yield dict(row)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({'size': len(self._rows), 'synced': self._synced, 'synced_at': self._synced_at})
+        return stats
+
+
+def _load(cache, index, rows):
+    cache.replace(rows)
+    if index is not None:
+        index.load_rows(rows)
+
+
+def _apply(cache, index, row):
+    mac, binding_id = cache.apply(row)
+    if index is not None and mac:
+        if binding_id:
+            index.set(mac, binding_id)
+        else:
+            index.discard(mac)
+
+
+# Seguidor em thread (servidor Flask). `connect()` abre uma sessão da librouteros
+# dedicada, que fica presa ao listen. Sem nenhuma mensagem por `heartbeat` segundos,
+# envia um print barato; sem resposta no intervalo seguinte, considera a sessão morta.
+class BindingFollower:
+    def __init__(self, cache, connect, index=None, name='', heartbeat=30, retry_base=1, retry_max=60):
+        self.cache = cache
+        self.connect = connect
+        self.index = index
+        self.name = name
+        self.heartbeat = heartbeat
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._stopped = threading.Event()
+        self._api = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f'binding-follower-{self.name}', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopped.set()
+        api = self._api
+        if api is not None:
+            try:
+                api.close()
+            except Exception:
+                pass
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        failures = 0
+        while not self._stopped.is_set():
+            try:
+                self._api = self.connect()
+                self._follow(self._api)
+            except Exception as e:
+                if self._stopped.is_set():
+                    break
+                log.warning("Fluxo de mudanças do IP Binding interrompido", extra={'router': self.name, 'error': str(e)})
+            finally:
+                if self._api is not None:
+                    try:
+                        self._api.close()
+                    except Exception:
+                        pass
+                    self._api = None
+            # a espera volta ao mínimo depois de uma sessão que chegou a sincronizar
+            failures = 1 if self.cache.synced else failures + 1
+            self.cache.mark_unsynced()
+            self._stopped.wait(min(self.retry_max, self.retry_base * (2 ** (failures - 1))))
+
+    def _follow(self, api):
+        protocol = api.protocol
+        sock = protocol.transport.sock
+        protocol.writeSentence(f'{BINDING_PATH}/listen', f'.tag={LISTEN_TAG}')
+        protocol.writeSentence(f'{BINDING_PATH}/print', f'.tag={SNAPSHOT_TAG}')
+        snapshot, early = [], []
+        synced = False
+        ping_pending = False
+
+        while not self._stopped.is_set():
+            readable, _, _ = select.select([sock], [], [], self.heartbeat)
+            if not readable:
+                if ping_pending:
+                    raise ConnectionError("MikroTik não respondeu ao heartbeat")
+                protocol.writeSentence('/system/identity/print', f'.tag={PING_TAG}')
+                ping_pending = True
+                continue
+
+            reply_word, words = protocol.readSentence()
+            tag, attributes = parse_words(words)
+            if tag == PING_TAG:
+                ping_pending = ping_pending and reply_word != '!done'
+            elif reply_word == '!trap':
+                raise RuntimeError(f"Erro no {tag} do IP Binding: {attributes.get('message')}")
+            elif tag == SNAPSHOT_TAG:
+                if reply_word == '!re':
+                    snapshot.append(attributes)
+                elif reply_word == '!done':
+                    _load(self.cache, self.index, snapshot)
+                    for row in early:
+                        _apply(self.cache, self.index, row)
+                    snapshot, early, synced = [], [], True
+                    log.info("Cópia do IP Binding sincronizada",
+                             extra={'router': self.name, 'size': self.cache.stats()['size']})
+            elif tag == LISTEN_TAG:
+                if reply_word == '!done':
+                    raise ConnectionError("listen do IP Binding encerrado pelo roteador")
+                if reply_word == '!re':
+                    if synced:
+                        _apply(self.cache, self.index, attributes)
+                    else:
+                        early.append(attributes)
+
+
+# Seguidor assíncrono (servidor_async), sobre um cliente AsyncRouterOS dedicado ao listen.
+# Roda até ser cancelado.
+async def follow_bindings(cache, client, index=None, name='', heartbeat=30, retry_base=1, retry_max=60):
+    failures = 0
+    while True:
+        stream = None
+        state = {'synced': False, 'early': []}
+
+        def on_change(row):
+            if state['synced']:
+                _apply(cache, index, row)
+            else:
+                state['early'].append(row)
+
+        try:
+            stream = await client.stream(f'{BINDING_PATH}/listen', on_row=on_change)
+            rows = await client(f'{BINDING_PATH}/print')
+            _load(cache, index, rows)
+            for row in state['early']:
+                _apply(cache, index, row)
+            state['synced'] = True
+            log.info("Cópia do IP Binding sincronizada", extra={'router': name, 'size': len(rows)})
+
+            while True:
+                done, _ = await asyncio.wait({stream.future}, timeout=heartbeat)
+                if done:
+                    stream.result()
+                    raise ConnectionError("listen do IP Binding encerrado pelo roteador")
+                try:
+                    await client('/system/identity/print', timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    client.disconnect("MikroTik não respondeu ao heartbeat")
+                    raise
+        except asyncio.CancelledError:
+            if stream:
+                stream.cancel()
+            raise
+        except Exception as e:
+            log.warning("Fluxo de mudanças do IP Binding interrompido", extra={'router': name, 'error': str(e)})
+            if stream:
+                stream.cancel()
+        failures = 1 if cache.synced else failures + 1
+        cache.mark_unsynced()
+        await asyncio.sleep(min(retry_max, retry_base * (2 ** (failures - 1))))
+
+
+# Linhas das cópias dos gateways que atendem à consulta de GET /bindings, cada uma
+# com o nome do roteador, geradas sob demanda (a resposta NDJSON não é montada na memória)
+def iter_bindings(gateways, mac=None, comment=None):
+    for gateway in gateways:
+        for row in gateway.bindings.select(mac, comment):
+            row['router'] = gateway.name
+            yield row
+
+
+# Página da consulta: (total de linhas que atendem, linhas de offset a offset + limit)
+def page_bindings(gateways, mac=None, comment=None, offset=0, limit=100):
+    total, page = 0, []
+    for row in iter_bindings(gateways, mac, comment):
+        if offset <= total < offset + limit:
+            page.append(row)
+        total += 1
+    return total, page
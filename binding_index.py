@@ -0,0 +1,137 @@
+from routeros_pipeline import pipeline, query
+import threading, re
+
+BINDING_PATH = '/ip/hotspot/ip-binding'
+
+_MAC_SEPARATORS = re.compile(r'[\s:\-\.]')
+_MAC_HEX = re.compile(r'^[0-9A-F]{12}$')
+
+
+# Normaliza o MAC para o formato usado pelo RouterOS (AA:BB:CC:DD:EE:FF), aceitando
+# minúsculas e separadores ':', '-', '.' ou nenhum (ex: aabb.ccdd.eeff, AABBCCDDEEFF)
+def normalize_mac(mac_address):
+    if not isinstance(mac_address, str):
+        raise ValueError(f"MAC inválido: {mac_address!r}")
+    digits = _MAC_SEPARATORS.sub('', mac_address).upper()
+    if not _MAC_HEX.match(digits):
+        raise ValueError(f"MAC inválido: {mac_address!r}")
+    return ':'.join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+# Índice local MAC -> .id das entradas de /ip/hotspot/ip-binding.
+# É carregado uma única vez com um print completo e depois mantido pelas próprias
+# operações de add/remove; quando o MAC não está no índice, a consulta é feita no
+# roteador com filtro (?mac-address=), sem baixar a tabela inteira.
+class BindingIndex:
+    def __init__(self):
+        self._ids = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'server_lookups': 0, 'loads': 0}
+
+    def load(self, api):
+        return self.load_rows(tuple(api(f'{BINDING_PATH}/print')))
+
+    # Recarrega o índice a partir das linhas de um print completo já obtido
+    def load_rows(self, bindings):
+        ids = {}
+        for binding in bindings:
+            try:
+                ids[normalize_mac(binding.get('mac-address'))] = binding['.id']
+            except (ValueError, KeyError):
+                continue  # entradas por IP, sem MAC
+        with self._lock:
+            self._ids = ids
+            self._loaded = True
+            self._stats['loads'] += 1
+        return len(ids)
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def ensure_loaded(self, api):
+        if not self._loaded:
+            self.load(api)
+
+    # Consulta só o índice local, contabilizando acerto/falha
+    def cached(self, mac_address):
+        mac = normalize_mac(mac_address)
+        with self._lock:
+            binding_id = self._ids.get(mac)
+            self._stats['hits' if binding_id else 'misses'] += 1
+        return binding_id
+
+    # Registra o resultado de um print filtrado (?mac-address=) feito no roteador
+    def remember(self, mac_address, rows):
+        with self._lock:
+            self._stats['server_lookups'] += 1
+        if rows:
+            self.set(mac_address, rows[0]['.id'])
+            return rows[0]['.id']
+        self.discard(mac_address)
+        return None
+
+    # Consulta no roteador apenas as entradas do MAC informado
+    def query(self, api, mac_address):
+        mac = normalize_mac(mac_address)
+        return self.remember(mac, tuple(api.rawCmd(f'{BINDING_PATH}/print', f'?mac-address={mac}')))
+
+    # Retorna o .id do binding do MAC, ou None se o MAC não estiver no IP Binding
+    def lookup(self, api, mac_address):
+        self.ensure_loaded(api)
+        return self.cached(mac_address) or self.query(api, mac_address)
+
+    # Resolve vários MACs de uma vez: os que não estão no índice são consultados no
+    # roteador com prints filtrados enviados em pipeline. Retorna {mac: .id ou None}.
+    def lookup_many(self, api, mac_addresses):
+        macs = [normalize_mac(mac) for mac in mac_addresses]
+        self.ensure_loaded(api)
+        found = {}
+        missing = []
+        with self._lock:
+            for mac in macs:
+                binding_id = self._ids.get(mac)
+                if binding_id:
+                    found[mac] = binding_id
+                    self._stats['hits'] += 1
+                elif mac not in missing:
+                    missing.append(mac)
+                    self._stats['misses'] += 1
+            self._stats['server_lookups'] += len(missing)
+        if missing:
+            replies = pipeline(api, [query(f'{BINDING_PATH}/print', **{'mac-address': mac})
+                                     for mac in missing])
+            for mac, (ok, rows) in zip(missing, replies):
+                if not ok:
+                    raise LookupError(f"Erro ao consultar MAC {mac} no IP Binding: {rows}")
+                if rows:
+                    found[mac] = rows[0]['.id']
+                    self.set(mac, rows[0]['.id'])
+                else:
+                    found[mac] = None
+                    self.discard(mac)
+        return found
+
+    def get(self, mac_address):
+        with self._lock:
+            return self._ids.get(normalize_mac(mac_address))
+
+    def set(self, mac_address, binding_id):
+        with self._lock:
+            self._ids[normalize_mac(mac_address)] = binding_id
+
+    def discard(self, mac_address):
+        with self._lock:
+            self._ids.pop(normalize_mac(mac_address), None)
+
+    def invalidate(self):
+        with self._lock:
+            self._ids = {}
+            self._loaded = False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({'size': len(self._ids), 'loaded': self._loaded})
+        return stats
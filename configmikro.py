@@ -1,196 +1,121 @@
 from librouteros import connect
+from routeros_reconciler import reconcile_many, format_change
+from router_expiry import sweep_state, EXPIRY_MODES
+from urllib.parse import urlsplit
+import argparse, ipaddress, socket
 import os
 # Configurações do MikroTik a partir de variáveis de ambiente
 HOST = os.getenv('HOST', '192.168.88.1')  # IP do roteador MikroTik
 USERNAME = os.getenv('USERNAME', 'admin')  # Usuário da API
 PASSWORD = os.getenv('PASSWORD', 'admin')  # Senha do usuário da API
 PORT = int(os.getenv('PORT', 8728))        # Porta da API do MikroTik
-
-# Função para configurar regras de firewall
-def configure_firewall(site_compra_ip):
-    api = mikrotik_connect()
-    if not api:
-        return
-
-    try:
-        # Obter regras existentes para evitar duplicações
-        firewall_rules = api('/ip/firewall/filter/print')
-
-        # Regra 1: Permitir acesso ao site de compras na VLAN Restrita
-        if not any(rule.get('comment') == 'Permitir acesso ao site de compra na VLAN Restrita' for rule in firewall_rules):
-            api('/ip/firewall/filter/add', **{
-                'chain': 'forward',
-                'action': 'accept',
-                'src-address': '192.168.10.0/24',
-                'dst-address': site_compra_ip,
-                'comment': 'Permitir acesso ao site de compra na VLAN Restrita'
-            })
-            print("Regra: Permitir acesso ao site de compra na VLAN Restrita adicionada.")
-
-        # Regra 2: Bloquear todo o restante na VLAN Restrita
-        if not any(rule.get('comment') == 'Bloquear acesso irrestrito na VLAN Restrita' for rule in firewall_rules):
-            api('/ip/firewall/filter/add', **{
-                'chain': 'forward',
-                'action': 'drop',
-                'src-address': '192.168.10.0/24',
-                'comment': 'Bloquear acesso irrestrito na VLAN Restrita'
-            })
-            print("Regra: Bloquear acesso irrestrito na VLAN Restrita adicionada.")
-
-        # Regra 3: Permitir acesso total na VLAN Irrestrita
-        if not any(rule.get('comment') == 'Permitir acesso irrestrito na VLAN Liberada' for rule in firewall_rules):
-            api('/ip/firewall/filter/add', **{
-                'chain': 'forward',
-                'action': 'accept',
-                'src-address': '192.168.20.0/24',
-                'comment': 'Permitir acesso irrestrito na VLAN Liberada'
-            })
-            print("Regra: Permitir acesso irrestrito na VLAN Liberada adicionada.")
-
-        print("Regras de firewall configuradas com sucesso.")
-    except Exception as e:
-        print(f"Erro ao configurar firewall: {e}")
-# Função para conectar ao MikroTik
-def mikrotik_connect():
-    try:
-        return connect(username=USERNAME, password=PASSWORD, host=HOST, port=PORT)
-    except Exception as e:
-        print(f"Erro ao conectar ao MikroTik: {e}")
-        return None
-
-# Função para configurar a bridge e VLANs
-def configure_bridge_and_vlans():
-    api = mikrotik_connect()
-    if not api:
-        return
-
+ROUTER_ENCODING = os.getenv('ROUTER_ENCODING', 'latin-1')  # Codificação dos textos na API (comentários)
+
+
+# Estado desejado de cada roteador: bridge, VLANs, endereços, pools, servidores
+# DHCP, hotspot, firewall e a varredura dos bindings vencidos (só com
+# expiry_mode='router'; no modo 'app' ela é removida). As tabelas são aplicadas
+# nesta ordem.
+def desired_state(site_compra_ip, expiry_mode='app', sweep_interval=60):
+    return [
+        # Bridge
+        {'path': '/interface/bridge', 'key': 'name', 'entries': [
+            {'name': 'bridge1'},
+        ]},
+        # VLAN Restrita (VLAN 10) e VLAN Liberada (VLAN 20)
+        {'path': '/interface/vlan', 'key': 'name', 'entries': [
+            {'name': 'vlan-restrita', 'vlan-id': '10', 'interface': 'bridge1'},
+            {'name': 'vlan-liberada', 'vlan-id': '20', 'interface': 'bridge1'},
+        ]},
+        # Endereços IP das VLANs
+        {'path': '/ip/address', 'key': 'address', 'entries': [
+            {'address': '192.168.10.1/24', 'interface': 'vlan-restrita'},
+            {'address': '192.168.20.1/24', 'interface': 'vlan-liberada'},
+        ]},
+        # Pools de IP do DHCP
+        {'path': '/ip/pool', 'key': 'name', 'entries': [
+            {'name': 'dhcp_pool_vlan10', 'ranges': '192.168.10.10-192.168.10.100'},
+            {'name': 'dhcp_pool_vlan20', 'ranges': '192.168.20.10-192.168.20.100'},
+        ]},
+        # Servidores DHCP das VLANs
+        {'path': '/ip/dhcp-server', 'key': 'name', 'entries': [
+            {'name': 'dhcp_vlan10', 'interface': 'vlan-restrita',
+             'address-pool': 'dhcp_pool_vlan10', 'disabled': 'no'},
+            {'name': 'dhcp_vlan20', 'interface': 'vlan-liberada',
+             'address-pool': 'dhcp_pool_vlan20', 'disabled': 'no'},
+        ]},
+        # Hotspot na bridge1
+        {'path': '/ip/hotspot', 'key': 'interface', 'entries': [
+            {'interface': 'bridge1'},
+        ]},
+        # Regras de firewall, na ordem em que devem ser avaliadas
+        {'path': '/ip/firewall/filter', 'key': 'comment', 'ordered': True, 'entries': [
+            {'chain': 'forward', 'action': 'accept', 'src-address': '192.168.10.0/24',
+             'dst-address': site_compra_ip,
+             'comment': 'Permitir acesso ao site de compra na VLAN Restrita'},
+            {'chain': 'forward', 'action': 'drop', 'src-address': '192.168.10.0/24',
+             'comment': 'Bloquear acesso irrestrito na VLAN Restrita'},
+            {'chain': 'forward', 'action': 'accept', 'src-address': '192.168.20.0/24',
+             'comment': 'Permitir acesso irrestrito na VLAN Liberada'},
+        ]},
+        # Remoção dos bindings vencidos pelo próprio roteador (EXPIRY_MODE=router)
+    ] + sweep_state(sweep_interval, enabled=expiry_mode == 'router')
+
+
+# Endereço do site de compra para o dst-address do firewall. Aceita um IP (ou rede)
+# ou um nome/URL, resolvido para o IPv4 atual do site; o RouterOS não aceita URLs
+# no dst-address e um valor inválido interromperia o restante da configuração.
+def site_address(value):
     try:
-        # Criar Bridge
-        print("Configurando a bridge...")
-        bridges = api('/interface/bridge/print')
-        if not any(bridge['name'] == 'bridge1' for bridge in bridges):
-            api('/interface/bridge/add', **{'name': 'bridge1'})
-            print("Bridge 'bridge1' criada com sucesso.")
-        else:
-            print("Bridge 'bridge1' já existe.")
-
-        # Criar VLAN Restrita (VLAN 10)
-        print("Configurando VLANs...")
-        vlans = api('/interface/vlan/print')
-        if not any(vlan['name'] == 'vlan-restrita' for vlan in vlans):
-            api('/interface/vlan/add', **{
-                'name': 'vlan-restrita',
-                'vlan-id': '10',
-                'interface': 'bridge1'
-            })
-            print("VLAN 'vlan-restrita' criada com sucesso.")
-        else:
-            print("VLAN 'vlan-restrita' já existe.")
-
-        # Criar VLAN Liberada (VLAN 20)
-        if not any(vlan['name'] == 'vlan-liberada' for vlan in vlans):
-            api('/interface/vlan/add', **{
-                'name': 'vlan-liberada',
-                'vlan-id': '20',
-                'interface': 'bridge1'
-            })
-            print("VLAN 'vlan-liberada' criada com sucesso.")
-        else:
-            print("VLAN 'vlan-liberada' já existe.")
-
-        # Configurar endereços IP para as VLANs
-        print("Configurando endereços IP...")
-        ip_addresses = api('/ip/address/print')
-        if not any(ip['address'].startswith('192.168.10.') for ip in ip_addresses):
-            api('/ip/address/add', **{
-                'address': '192.168.10.1/24',
-                'interface': 'vlan-restrita'
-            })
-            print("Endereço IP configurado para 'vlan-restrita'.")
-
-        if not any(ip['address'].startswith('192.168.20.') for ip in ip_addresses):
-            api('/ip/address/add', **{
-                'address': '192.168.20.1/24',
-                'interface': 'vlan-liberada'
-            })
-            print("Endereço IP configurado para 'vlan-liberada'.")
-
-        print("Configuração de bridge e VLANs concluída com sucesso.")
-    except Exception as e:
-        print(f"Erro ao configurar bridge e VLANs: {e}")
-
-# Função para configurar o servidor DHCP para as VLANs
-def configure_dhcp():
-    api = mikrotik_connect()
-    if not api:
-        return
-
+        network = ipaddress.ip_network(value, strict=False)
+        # o RouterOS exibe um endereço único sem o /32; igual aqui, para o diff não acusar mudança
+        return str(network.network_address if network.num_addresses == 1 else network)
+    except ValueError:
+        pass
+    host = urlsplit(value if '//' in value else f'//{value}').hostname
+    if not host:
+        raise ValueError(f"Endereço inválido para o site de compra: {value!r}")
     try:
-        # Configurar Pool de IP para VLAN Restrita
-        print("Configurando servidor DHCP...")
-        pools = api('/ip/pool/print')
-        if not any(pool['name'] == 'dhcp_pool_vlan10' for pool in pools):
-            api('/ip/pool/add', **{
-                'name': 'dhcp_pool_vlan10',
-                'ranges': '192.168.10.10-192.168.10.100'
-            })
-            print("Pool de IP 'dhcp_pool_vlan10' criado com sucesso.")
+        return socket.getaddrinfo(host, None, socket.AF_INET)[0][4][0]
+    except OSError as e:
+        raise ValueError(f"Não foi possível resolver o site de compra {host!r}: {e}") from e
 
-        # Configurar Pool de IP para VLAN Liberada
-        if not any(pool['name'] == 'dhcp_pool_vlan20' for pool in pools):
-            api('/ip/pool/add', **{
-                'name': 'dhcp_pool_vlan20',
-                'ranges': '192.168.20.10-192.168.20.100'
-            })
-            print("Pool de IP 'dhcp_pool_vlan20' criado com sucesso.")
 
-        # Configurar DHCP Server para VLAN Restrita
-        dhcp_servers = api('/ip/dhcp-server/print')
-        if not any(dhcp['name'] == 'dhcp_vlan10' for dhcp in dhcp_servers):
-            api('/ip/dhcp-server/add', **{
-                'name': 'dhcp_vlan10',
-                'interface': 'vlan-restrita',
-                'address-pool': 'dhcp_pool_vlan10',
-                'disabled': 'no'
-            })
-            print("Servidor DHCP 'dhcp_vlan10' configurado com sucesso.")
-
-        # Configurar DHCP Server para VLAN Liberada
-        if not any(dhcp['name'] == 'dhcp_vlan20' for dhcp in dhcp_servers):
-            api('/ip/dhcp-server/add', **{
-                'name': 'dhcp_vlan20',
-                'interface': 'vlan-liberada',
-                'address-pool': 'dhcp_pool_vlan20',
-                'disabled': 'no'
-            })
-            print("Servidor DHCP 'dhcp_vlan20' configurado com sucesso.")
-
-        print("Configuração de DHCP concluída com sucesso.")
-    except Exception as e:
-        print(f"Erro ao configurar DHCP: {e}")
-
-# Configurar Hotspot na bridge1
-def configure_hotspot():
-    api = mikrotik_connect()
-    if not api:
-        return
+# Função para conectar ao MikroTik
+def mikrotik_connect(host=HOST):
+    return connect(username=USERNAME, password=PASSWORD, host=host, port=PORT,
+                   encoding=ROUTER_ENCODING)
 
-    try:
-        # Verificar se o Hotspot já está configurado
-        hotspots = api('/ip/hotspot/print')
-        if not hotspots:
-            api('/ip/hotspot/setup', **{'interface': 'bridge1'})
-            print("Hotspot configurado na interface 'bridge1'.")
-        else:
-            print("Hotspot já está configurado.")
-    except Exception as e:
-        print(f"Erro ao configurar o Hotspot: {e}")
-    
 
 # Função principal para executar as configurações
 if __name__ == '__main__':
-    configure_bridge_and_vlans()
-    configure_dhcp()
-    configure_hotspot()
-    site_compra_ip = 'https://rmwifi.shop/'  # IP do site de compra de acesso
-    configure_firewall(site_compra_ip)
+    parser = argparse.ArgumentParser(description='Provisiona roteadores MikroTik a partir do estado desejado')
+    parser.add_argument('hosts', nargs='*', default=[HOST], help='Roteadores a configurar (padrão: HOST)')
+    parser.add_argument('--plan', action='store_true', help='Só mostra as mudanças, sem aplicar')
+    parser.add_argument('--parallel', type=int, default=8, help='Roteadores configurados ao mesmo tempo')
+    parser.add_argument('--site-compra-ip', default='rmwifi.shop',
+                        help='IP ou nome do site de compra de acesso (nomes são resolvidos para o IPv4 atual)')
+    parser.add_argument('--expiry-mode', choices=EXPIRY_MODES, default=os.getenv('EXPIRY_MODE', 'app'),
+                        help="Quem remove os bindings vencidos: o serviço ('app') ou uma varredura no roteador ('router')")
+    parser.add_argument('--sweep-interval', type=int, default=int(os.getenv('EXPIRY_SWEEP_INTERVAL', 60)),
+                        help='Intervalo, em segundos, da varredura dos bindings vencidos (--expiry-mode router)')
+    args = parser.parse_args()
+    try:
+        site_compra_ip = site_address(args.site_compra_ip)
+    except ValueError as e:
+        parser.error(str(e))
+
+    spec = desired_state(site_compra_ip, args.expiry_mode, args.sweep_interval)
+    results = reconcile_many(mikrotik_connect, args.hosts, spec,
+                             dry_run=args.plan, max_workers=args.parallel)
+    failed = False
+    for host, (changes, error) in results.items():
+        if error:
+            failed = True
+            print(f"[{host}] Erro: {error}")
+            continue
+        verb = "Mudanças planejadas" if args.plan else "Mudanças aplicadas"
+        print(f"[{host}] {verb}: {len(changes)}" if changes else f"[{host}] Configuração já está em dia.")
+        for change in changes:
+            print(f"[{host}]   {format_change(change)}")
+    raise SystemExit(1 if failed else 0)
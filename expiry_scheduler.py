@@ -0,0 +1,192 @@
+from metrics import ERRORS
+import threading, heapq, sqlite3, time, os, logging
+
+log = logging.getLogger(__name__)
+
+
+# Armazenamento durável das expirações pendentes (SQLite em modo WAL).
+# Cada MAC tem no máximo uma expiração; agendar de novo substitui a anterior.
+# Guarda também o roteador onde o MAC foi liberado (quando há mais de um).
+class ExpiryStore:
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS expiries (
+                mac_address TEXT PRIMARY KEY,
+                expires_at REAL NOT NULL,
+                router TEXT
+            )
+        ''')
+        columns = [row[1] for row in self._db.execute('PRAGMA table_info(expiries)')]
+        if 'router' not in columns:
+            self._db.execute('ALTER TABLE expiries ADD COLUMN router TEXT')
+
+    def upsert(self, mac_address, expires_at, router=None):
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO expiries (mac_address, expires_at, router) VALUES (?, ?, ?) '
+                'ON CONFLICT(mac_address) DO UPDATE SET expires_at = excluded.expires_at, '
+                'router = excluded.router',
+                (mac_address, expires_at, router))
+
+    # Remove as expirações dos MACs, desde que não tenham sido reagendadas nesse meio tempo
+    def delete(self, entries):
+        with self._lock:
+            self._db.executemany(
+                'DELETE FROM expiries WHERE mac_address = ? AND expires_at = ?', entries)
+
+    def delete_mac(self, mac_address):
+        with self._lock:
+            self._db.execute('DELETE FROM expiries WHERE mac_address = ?', (mac_address,))
+
+    def all(self):
+        with self._lock:
+            return self._db.execute('SELECT mac_address, expires_at, router FROM expiries').fetchall()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# Agendador único de expirações: uma só thread dorme até a próxima expiração de um
+# heap, em vez de uma threading.Timer por MAC. As expirações que vencem juntas
+# (dentro de `batch_window` segundos) são entregues de uma vez a `on_expire`, que
+# recebe a lista de MACs e devolve os que foram tratados; os demais são
+# reagendados para daqui a `retry_delay` segundos.
+class ExpiryScheduler:
+    def __init__(self, store, on_expire, batch_window=1.0, retry_delay=30, max_batch=100):
+        self.store = store
+        self.on_expire = on_expire
+        self.batch_window = batch_window
+        self.retry_delay = retry_delay
+        self.max_batch = max_batch
+
+        self._heap = []       # (expires_at, mac_address); entradas antigas são ignoradas
+        self._expiries = {}   # mac_address -> expires_at vigente
+        self._routers = {}    # mac_address -> roteador onde o MAC foi liberado
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    # Carrega as expirações persistidas; chamado antes de start()
+    def load(self):
+        entries = self.store.all()
+        with self._cond:
+            for mac_address, expires_at, router in entries:
+                self._expiries[mac_address] = expires_at
+                self._routers[mac_address] = router
+                heapq.heappush(self._heap, (expires_at, mac_address))
+        return len(entries)
+
+    # Memória e disco são atualizados sob o mesmo lock para não divergirem
+    def schedule(self, mac_address, expires_at, router=None):
+        with self._cond:
+            self.store.upsert(mac_address, expires_at, router)
+            self._expiries[mac_address] = expires_at
+            self._routers[mac_address] = router
+            heapq.heappush(self._heap, (expires_at, mac_address))
+            self._cond.notify()
+
+    def cancel(self, mac_address):
+        with self._cond:
+            self.store.delete_mac(mac_address)
+            self._routers.pop(mac_address, None)
+            return self._expiries.pop(mac_address, None) is not None
+
+    def expires_at(self, mac_address):
+        with self._cond:
+            return self._expiries.get(mac_address)
+
+    # Se a expiração vigente do MAC já venceu (considerando a janela de lote). Quem
+    # recebe a expiração confere isso antes de remover, sob o lock do MAC: um MAC
+    # renovado enquanto a expiração antiga era entregue não perde o acesso.
+    def is_due(self, mac_address, now=None):
+        now = time.time() if now is None else now
+        with self._cond:
+            expires_at = self._expiries.get(mac_address)
+        return expires_at is not None and expires_at <= now + self.batch_window
+
+    def router_of(self, mac_address):
+        with self._cond:
+            return self._routers.get(mac_address)
+
+    def pending(self):
+        with self._cond:
+            return dict(self._expiries)
+
+    # [(mac, expires_at, roteador)], da expiração mais próxima à mais distante
+    def entries(self):
+        with self._cond:
+            return sorted(((mac, expires_at, self._routers.get(mac))
+                           for mac, expires_at in self._expiries.items()), key=lambda entry: entry[1])
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._expiries)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='expiry-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+
+    # Retira do heap as expirações vencidas (e as que vencem dentro da janela de lote)
+    def _pop_due(self):
+        with self._cond:
+            while not self._stopped:
+                while self._heap and self._expiries.get(self._heap[0][1]) != self._heap[0][0]:
+                    heapq.heappop(self._heap)  # cancelada ou reagendada
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                wait = self._heap[0][0] - time.time()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+
+                horizon = time.time() + self.batch_window
+                due = []
+                while self._heap and self._heap[0][0] <= horizon and len(due) < self.max_batch:
+                    expires_at, mac_address = heapq.heappop(self._heap)
+                    if self._expiries.get(mac_address) == expires_at:
+                        due.append((mac_address, expires_at))
+                return due
+            return []
+
+    def _run(self):
+        while True:
+            due = self._pop_due()
+            if not due:
+                return
+            try:
+                handled = set(self.on_expire([mac for mac, _ in due]))
+            except Exception:
+                log.exception("Erro ao processar expirações")
+                handled = set()
+
+            done = [(mac, expires_at) for mac, expires_at in due if mac in handled]
+            self.store.delete(done)
+            retry_at = time.time() + self.retry_delay
+            with self._cond:
+                for mac, expires_at in done:
+                    if self._expiries.get(mac) == expires_at:
+                        del self._expiries[mac]
+                        self._routers.pop(mac, None)
+                for mac, expires_at in due:
+                    if mac not in handled and self._expiries.get(mac) == expires_at:
+                        # Falhou: tenta de novo mais tarde, mantendo a persistência
+                        ERRORS.inc(kind='expiry_retry')
+                        self.store.upsert(mac, retry_at, self._routers.get(mac))
+                        self._expiries[mac] = retry_at
+                        heapq.heappush(self._heap, (retry_at, mac))
@@ -1,136 +1,536 @@
-from flask import Flask, request, jsonify
-from librouteros import connect
-import threading, json
-import os
+from flask import Flask, Response, request, jsonify, g
+from mikrotik_pool import MikrotikPool
+from binding_index import normalize_mac
+from router_registry import RouterRegistry
+from payloads import (
+    parse_add, parse_remove, parse_batch_add, parse_batch_remove, batch_body, parse_bindings_query,
+)
+from settings import (
+    ROUTER_CONFIGS, ROUTER_MACS, ROUTER_SITES, ROUTER_ENCODING, ADMISSION_QUEUE_SIZE, ADMISSION_MAX_WAIT,
+    EXPIRY_DB_PATH, EXPIRY_BATCH_WINDOW, EXPIRY_RETRY_DELAY, EXPIRY_MODE, EXPIRY_SWEEP_INTERVAL, LEASE_MODE,
+    BINDING_CACHE, BINDING_HEARTBEAT, BATCH_MAX_ENTRIES,
+    MP_ACCESS_TOKEN, MP_WEBHOOK_SECRET, PAYMENT_DB_PATH, PAYMENT_MAX_ATTEMPTS,
+)
+from service import (
+    request_site, lease_terms, leased_here, service_binding, binding_taken, current_lease, record_lease,
+    admission_rejection,
+    NOTIFICATION_OK, NOTIFICATION_FAILED, check_payment_notification, log_payment_recorded,
+    bindings_gateways, bindings_ndjson, bindings_page, expiries_body, routers_health,
+    reconcile_gateway_expiries,
+)
+from expiry_scheduler import ExpiryStore, ExpiryScheduler
+from webhook_queue import PaymentEventStore, PaymentWorker, fetch_mercadopago_payment
+from routeros_pipeline import pipeline, command, query
+from router_expiry import install_sweep
+from binding_cache import BindingFollower
+from mac_leases import MacLocks, SingleFlight
+from admission import AdmissionQueue, AdmissionError, REMOVE, ADD, READ
+from librouteros.exceptions import TrapError
+from metrics import REGISTRY, CONTENT_TYPE, EXPIRIES_PENDING, LEASES, observe_http
+from logs import setup_logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import time, logging
+import os, atexit
 app = Flask(__name__)
 
-# Configurações do MikroTik a partir de variáveis de ambiente
-HOST = os.getenv('HOST')  # IP do roteador MikroTik
-USERNAME = os.getenv('USERNAME')  # Usuário da API
-PASSWORD = os.getenv('PASSWORD')  # Senha do usuário da API
-PORT = int(os.getenv('PORT'))        # Porta da API do MikroTik
+# Logs estruturados com nível (LOG_LEVEL), escritos fora do caminho das requisições
+setup_logging()
+log = logging.getLogger(__name__)
 
-# Endpoint para receber notificações do Mercado Pago
-@app.route('/payment-notification', methods=['POST'])
-def payment_notification():
-    try:
-        # Log para verificar o endpoint foi acessado
-        print("Endpoint acessado pelo Mercado Pago!")
+# Configurações comuns aos dois servidores em settings.py (roteadores, expirações,
+# cópia do IP Binding, Mercado Pago); aqui só as do pool de sessões.
 
-        # Verifica o conteúdo enviado pelo Mercado Pago
-        if request.content_type == 'application/json':
-            data = request.json  # Tenta extrair o JSON diretamente
-            print("JSON recebido:", data)
-        else:
-            return jsonify({"success": False, "message": "Conteúdo inválido"}), 400
+# Configurações do pool de conexões com a API do MikroTik
+POOL_SIZE = int(os.getenv('POOL_SIZE', 4))                     # Máximo de sessões abertas
+POOL_ACQUIRE_TIMEOUT = float(os.getenv('POOL_ACQUIRE_TIMEOUT', 10))  # Espera por uma sessão livre
+POOL_MAX_IDLE = float(os.getenv('POOL_MAX_IDLE', 300))         # Sessões ociosas por mais tempo são fechadas
+POOL_HEALTH_CHECK_INTERVAL = float(os.getenv('POOL_HEALTH_CHECK_INTERVAL', 30))
 
-        # Verifica se os dados foram enviados corretamente
-        if not data:
-            print("Nenhum dado recebido na notificação.")
-            return jsonify({"success": False, "message": "Nenhum dado enviado"}), 400
+# Operações simultâneas por roteador na fila de admissão (ver admission.py)
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', POOL_SIZE))
 
-        # Extração de informações da notificação
-        action = data.get("action")  # Ação realizada (ex: payment.updated)
-        notification_type = data.get("type")  # Tipo da notificação (ex: payment)
-        payment_id = data.get("data", {}).get("id")  # ID do pagamento
 
-        # Logs para depuração
-        print(f"Ação: {action}, Tipo: {notification_type}, ID do pagamento: {payment_id}")
+# Tempo de cada requisição por endpoint
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
 
-        # Validação dos dados extraídos
-        if not action or not notification_type or not payment_id:
-            print("Dados incompletos recebidos.")
-            return jsonify({"success": False, "message": "Dados incompletos"}), 400
 
-        # Processamento da notificação
-        if notification_type == "payment" and action == "payment.updated":
-            print(f"Pagamento atualizado! ID: {payment_id}")
-        else:
-            print(f"Notificação não tratada. Tipo: {notification_type}, Ação: {action}")
+@app.after_request
+def observe_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        observe_http(request.url_rule.rule if request.url_rule else None, request.method,
+                     response.status_code, time.perf_counter() - started)
+    return response
 
-        # Responde ao Mercado Pago que a notificação foi processada
-        return jsonify({"success": True, "message": "Notificação processada com sucesso"}), 200
 
-    except Exception as e:
-        print("Erro ao processar notificação:", str(e))
-        return jsonify({"success": False, "message": "Erro ao processar notificação"}), 500
+# Roteador sobrecarregado: 429/503 com Retry-After (ver service.admission_rejection)
+@app.errorhandler(AdmissionError)
+def admission_rejected(error):
+    body, status, headers = admission_rejection(error)
+    return jsonify(body), status, headers
 
 
-
-
-# Conexão ao MikroTik
-def mikrotik_connect():
+# Endpoint para receber notificações do Mercado Pago
+@app.route('/payment-notification', methods=['POST'])
+def payment_notification():
+    try:
+        payment, error = check_payment_notification(
+            request.content_type, request.get_json(silent=True), request.headers, request.args, MP_WEBHOOK_SECRET)
+        if error:
+            return jsonify(error[0]), error[1]
+
+        # Registra a notificação na fila durável; a liberação é feita pelo worker
+        if payment:
+            log_payment_recorded(*payment, record_payment_event(*payment))
+
+        # Responde ao Mercado Pago imediatamente
+        return jsonify(NOTIFICATION_OK), 200
+
+    except Exception:
+        log.exception("Erro ao processar notificação")
+        return jsonify(NOTIFICATION_FAILED), 500
+
+
+
+
+# Um pool de conexões por roteador, compartilhado pelos endpoints e pelas remoções agendadas
+def _router_pool(config):
+    return MikrotikPool(
+        host=config['host'], username=config['username'], password=config['password'],
+        port=config['port'], max_size=POOL_SIZE, acquire_timeout=POOL_ACQUIRE_TIMEOUT,
+        max_idle=POOL_MAX_IDLE, health_check_interval=POOL_HEALTH_CHECK_INTERVAL,
+        encoding=ROUTER_ENCODING, name=config['name'],
+    )
+
+
+def _router_admission(config):
+    return AdmissionQueue(config['name'], max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+                          max_queue=ADMISSION_QUEUE_SIZE, max_wait=ADMISSION_MAX_WAIT)
+
+
+# Registro dos roteadores; cada um tem seu pool, sua fila de admissão e seu índice
+# local MAC -> .id do IP Binding
+registry = RouterRegistry(ROUTER_CONFIGS, _router_pool, ROUTER_MACS, ROUTER_SITES,
+                          admission=_router_admission)
+for gateway in registry:
+    atexit.register(gateway.client.close)
+
+# Operações em lote rodam uma tarefa por roteador, cada roteador com suas próprias
+# threads: um roteador lento ocupa só as dele e não atrasa os demais
+router_executors = {}
+for gateway in registry:
+    router_executors[gateway] = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix=f'router-{gateway.name}')
+    atexit.register(router_executors[gateway].shutdown, wait=False)
+
+# Um seguidor por roteador mantém gateway.bindings (e gateway.index) em dia
+binding_followers = []
+if BINDING_CACHE:
+    for gateway in registry:
+        follower = BindingFollower(gateway.bindings, gateway.client.open_session, gateway.index,
+                                   name=gateway.name, heartbeat=BINDING_HEARTBEAT)
+        follower.start()
+        atexit.register(follower.stop)
+        binding_followers.append(follower)
+
+
+# Sessão do pool do roteador, aberta só depois da vaga na fila de admissão com a
+# prioridade da operação. Quem também trava MACs pega os locks antes, para não
+# ocupar uma vaga esperando por outro MAC.
+@contextmanager
+def router_session(gateway, priority):
+    with gateway.admission.slot(priority), gateway.client.connection() as api:
+        yield api
+
+
+# Executa `fn(gateway, macs)` para cada grupo em paralelo e junta os resultados
+# {mac: (sucesso, mensagem)}. Se um roteador falha, seus MACs recebem o erro.
+def _per_router(fn, groups, error_message):
+    futures = {gateway: router_executors[gateway].submit(fn, gateway, macs) for gateway, macs in groups.items()}
+    results = {}
+    for gateway, future in futures.items():
+        try:
+            results.update(future.result())
+        except Exception as e:
+            log.error(error_message, extra={'router': gateway.name, 'error': str(e)})
+            for mac_address in groups[gateway]:
+                results[mac_address] = (False, f"{error_message}: {e}")
+    return results
+
+
+# Cada MAC é alterado por uma operação de cada vez (liberação, renovação, remoção ou
+# expiração) e liberações idênticas simultâneas (retentativas) viram uma só escrita
+mac_locks = MacLocks()
+add_flights = SingleFlight(on_coalesced=lambda: LEASES.inc(outcome='coalesced'))
+
+
+# Prazo e comentário de uma liberação (ver service.lease_terms). Chamado com o lock do
+# MAC, antes da escrita no roteador; `on_lease(prazo)` recebe o prazo calculado.
+def _lease(mac_address, duration, bound, on_lease=None):
+    expires_at, comment = lease_terms(expiry_scheduler, mac_address, duration, bound, LEASE_MODE, EXPIRY_MODE)
+    if on_lease:
+        on_lease(expires_at)
+    return expires_at, comment
+
+
+# Só o comentário: o tipo do binding nunca é reescrito
+def _set_lease(api, binding_id, comment):
+    tuple(api('/ip/hotspot/ip-binding/set', **{'.id': binding_id, 'comment': comment}))
+
+
+# Binding atual do MAC e se ele foi criado pelo serviço (ver service.leased_here).
+# Sem expiração local, o print filtrado também corrige o índice: sem linhas, o .id
+# era de uma entrada removida por fora e o MAC é liberado com um novo binding.
+# Retorna (.id ou None, do serviço).
+def _current_binding(gateway, api, mac_address):
+    binding_id = gateway.index.lookup(api, mac_address)
+    if not binding_id or leased_here(expiry_scheduler, gateway, mac_address):
+        return binding_id, True
+    rows = tuple(api.rawCmd('/ip/hotspot/ip-binding/print', f'?mac-address={mac_address}'))
+    return gateway.index.remember(mac_address, rows), not rows or service_binding(rows)
+
+
+# Libera ou renova o MAC no roteador. Um MAC já liberado pelo serviço tem o
+# comentário (com o novo prazo) atualizado por /set, sem novo binding; um binding
+# criado por fora recusa a liberação.
+def _grant(gateway, mac_address, duration, on_lease=None):
+    with mac_locks.hold(mac_address), router_session(gateway, ADD) as api:
+        binding_id, owned = _current_binding(gateway, api, mac_address)
+        if not owned:
+            return binding_taken(mac_address)
+        expires_at, comment = _lease(mac_address, duration, bool(binding_id), on_lease)
+        if binding_id:
+            try:
+                _set_lease(api, binding_id, comment)
+            except TrapError:
+                # .id desatualizado (entrada removida ou recriada por fora): consulta o roteador
+                gateway.index.discard(mac_address)
+                binding_id, owned = _current_binding(gateway, api, mac_address)
+                if not owned:
+                    return binding_taken(mac_address)
+                if binding_id:
+                    _set_lease(api, binding_id, comment)
+                else:
+                    expires_at, comment = _lease(mac_address, duration, False, on_lease)
+        renewed = bool(binding_id)
+        if not renewed:
+            result = tuple(api('/ip/hotspot/ip-binding/add', **{
+                'mac-address': mac_address,
+                'type': 'bypassed',
+                'comment': comment
+            }))
+            if result and 'ret' in result[0]:
+                gateway.index.set(mac_address, result[0]['ret'])
+
+        return record_lease(expiry_scheduler, gateway, mac_address, duration, expires_at, renewed)
+
+
+# Adicionar MAC ao IP Binding do roteador informado (ou do roteador do MAC), ou
+# renovar o prazo se ele já estiver liberado
+def add_mac_to_ip_binding(mac_address, duration, gateway=None):
     try:
-        return connect(username=USERNAME, password=PASSWORD, host=HOST, port=PORT)
+        mac_address = normalize_mac(mac_address)
+        gateway = gateway or registry.route(mac_address)
+        return add_flights.do((mac_address, duration), lambda: _grant(gateway, mac_address, duration))
+    except AdmissionError:
+        raise
     except Exception as e:
-        print(f"Erro ao conectar ao MikroTik: {e}")
-        return None
+        return False, f"Erro ao adicionar MAC ao IP Binding: {e}"
 
 
-# Adicionar MAC ao IP Binding
-def add_mac_to_ip_binding(mac_address, duration):
-    api = mikrotik_connect()
-    if not api:
-        return False, "Erro ao conectar ao MikroTik"
 
+# Remove o binding do MAC usando uma sessão já aberta. Retorna True se o MAC não
+# está mais no IP Binding (removido agora ou já ausente).
+def _remove_binding(gateway, api, mac_address):
+    # Buscar o .id do MAC no índice (ou no roteador, se não estiver no índice) e remover
+    binding_id = gateway.index.lookup(api, mac_address)
+    if not binding_id:
+        return True
+    try:
+        tuple(api('/ip/hotspot/ip-binding/remove', **{'.id': binding_id}))
+    except TrapError:
+        # .id desatualizado (entrada removida por fora): consulta o roteador e tenta de novo
+        binding_id = gateway.index.query(api, mac_address)
+        if not binding_id:
+            return True
+        tuple(api('/ip/hotspot/ip-binding/remove', **{'.id': binding_id}))
+    gateway.index.discard(mac_address)
+    log.info("MAC removido do IP Binding", extra={'router': gateway.name, 'mac': mac_address})
+    return True
+
+
+# Remover MAC do IP Binding do roteador onde ele foi liberado
+def remove_mac_from_ip_binding(mac_address, gateway=None):
     try:
-        # Verificar se o MAC já está no IP Binding
-        ip_bindings = api('/ip/hotspot/ip-binding/print')
-        if any(binding['mac-address'] == mac_address for binding in ip_bindings):
-            return False, f"MAC {mac_address} já está no IP Binding."
-
-        # Adicionar o MAC ao IP Binding
-        api('/ip/hotspot/ip-binding/add', **{
-            'mac-address': mac_address,
-            'type': 'bypassed',
-            'comment': f'Acesso temporário VLAN Irrestrita ({duration} segundos)'
-        })
-        print(f"MAC {mac_address} movido para VLAN Irrestrita por {duration} segundos.")
-
-        # Agendar remoção do MAC após o tempo especificado
-        threading.Timer(duration, remove_mac_from_ip_binding, args=[mac_address]).start()
-        return True, f"MAC {mac_address} adicionado com sucesso à VLAN Irrestrita."
+        mac_address = normalize_mac(mac_address)
+        gateway = gateway or registry.locate(mac_address, expiry_scheduler.router_of)
+        with mac_locks.hold(mac_address):
+            with router_session(gateway, REMOVE) as api:
+                _remove_binding(gateway, api, mac_address)
+            expiry_scheduler.cancel(mac_address)
+    except AdmissionError:
+        raise
     except Exception as e:
-        return False, f"Erro ao adicionar MAC ao IP Binding: {e}"
-    
+        log.error("Erro ao remover MAC do IP Binding", extra={'mac': mac_address, 'error': str(e)})
+
+
+# Libera ou renova vários MACs com sets/adds enviados em pipeline. Os sets que falham
+# por .id desatualizado são consultados de novo no roteador em uma segunda rodada.
+def _write_leases(gateway, api, entries, retry_stale=True):
+    results = {}
+    ids = gateway.index.lookup_many(api, [mac for mac, _ in entries])
+    # Bindings sem expiração local só são renovados se o comentário for do serviço
+    foreign = [mac for mac, _ in entries if ids.get(mac) and not leased_here(expiry_scheduler, gateway, mac)]
+    checks = dict(zip(foreign, pipeline(api, [query('/ip/hotspot/ip-binding/print', **{'mac-address': mac})
+                                              for mac in foreign])))
+    leases = []
+    commands = []
+    for mac_address, duration in entries:
+        binding_id = ids.get(mac_address)
+        if mac_address in checks:
+            ok, rows = checks[mac_address]
+            if not ok:
+                results[mac_address] = (False, f"Erro ao adicionar MAC ao IP Binding: {rows}")
+                continue
+            # Sem linhas, o .id do índice era de uma entrada removida por fora: nova liberação
+            binding_id = gateway.index.remember(mac_address, rows)
+            if binding_id and not service_binding(rows):
+                results[mac_address] = binding_taken(mac_address)
+                continue
+        expires_at, comment = _lease(mac_address, duration, bool(binding_id))
+        leases.append((mac_address, duration, binding_id, expires_at))
+        if binding_id:
+            commands.append(command('/ip/hotspot/ip-binding/set', **{'.id': binding_id, 'comment': comment}))
+        else:
+            commands.append(command('/ip/hotspot/ip-binding/add', **{
+                'mac-address': mac_address, 'type': 'bypassed', 'comment': comment}))
+    replies = pipeline(api, commands)
+
+    stale = []
+    for (mac_address, duration, binding_id, expires_at), (ok, reply) in zip(leases, replies):
+        if not ok:
+            if binding_id and retry_stale:
+                gateway.index.discard(mac_address)
+                stale.append((mac_address, duration))
+            else:
+                results[mac_address] = (False, f"Erro ao adicionar MAC ao IP Binding: {reply}")
+            continue
+        if not binding_id and reply and 'ret' in reply[0]:
+            gateway.index.set(mac_address, reply[0]['ret'])
+        results[mac_address] = record_lease(expiry_scheduler, gateway, mac_address, duration,
+                                            expires_at, bool(binding_id))
+    if stale:
+        results.update(_write_leases(gateway, api, stale, retry_stale=False))
+    return results
+
+
+# Adicionar (ou renovar) vários MACs no IP Binding de um roteador em uma única
+# sessão, com o lock de todos os MACs do lote. Recebe [(mac, duração)] já
+# validados e retorna {mac: (sucesso, mensagem)}.
+def _add_bindings(gateway, entries):
+    with mac_locks.hold(*(mac for mac, _ in entries)), router_session(gateway, ADD) as api:
+        results = _write_leases(gateway, api, entries)
+    log.info("MACs enviados ao IP Binding em lote", extra={'router': gateway.name, 'count': len(entries)})
+    return results
+
+
+# Adicionar vários MACs ao IP Binding, um lote por roteador, em paralelo
+def add_macs_to_ip_binding(entries, site=None):
+    durations = dict(entries)
+    groups = registry.group(list(durations), site=site)
+    return _per_router(
+        lambda gateway, macs: _add_bindings(gateway, [(mac, durations[mac]) for mac in macs]),
+        groups, "Erro ao adicionar MAC ao IP Binding")
+
+
+# Remove vários bindings com removes enviados em pipeline. Os que falham por .id
+# desatualizado são consultados de novo no roteador e removidos em uma segunda rodada.
+def _remove_bindings(gateway, api, mac_addresses, retry_stale=True):
+    results = {}
+    ids = gateway.index.lookup_many(api, mac_addresses)
+    targets = []
+    for mac_address, binding_id in ids.items():
+        if binding_id:
+            targets.append((mac_address, binding_id))
+        else:
+            results[mac_address] = (True, f"MAC {mac_address} não está no IP Binding.")
+
+    replies = pipeline(api, [command('/ip/hotspot/ip-binding/remove', **{'.id': binding_id})
+                             for _, binding_id in targets])
+    stale = []
+    for (mac_address, _), (ok, reply) in zip(targets, replies):
+        gateway.index.discard(mac_address)
+        if ok:
+            results[mac_address] = (True, f"MAC {mac_address} removido com sucesso.")
+        elif retry_stale:
+            stale.append(mac_address)
+        else:
+            results[mac_address] = (False, f"Erro ao remover MAC do IP Binding: {reply}")
+    if stale:
+        results.update(_remove_bindings(gateway, api, stale, retry_stale=False))
+    return results
+
+
+# Remove os bindings de um roteador com o lock dos MACs. Nas expirações (only_due),
+# os MACs renovados depois que a expiração foi entregue ficam de fora e contam como
+# tratados; nas remoções pedidas pelo cliente, as expirações dos removidos são canceladas.
+def _remove_bindings_on(gateway, mac_addresses, only_due=False):
+    with mac_locks.hold(*mac_addresses):
+        results = {}
+        if only_due:
+            results = {mac: (True, f"MAC {mac} renovado; expiração adiada.")
+                       for mac in mac_addresses if not expiry_scheduler.is_due(mac)}
+            mac_addresses = [mac for mac in mac_addresses if mac not in results]
+        if mac_addresses:
+            with router_session(gateway, REMOVE) as api:
+                results.update(_remove_bindings(gateway, api, mac_addresses))
+        if not only_due:
+            for mac_address, (ok, _) in results.items():
+                if ok:
+                    expiry_scheduler.cancel(mac_address)
+    return results
+
+
+# Remover vários MACs do IP Binding, um lote por roteador (o roteador onde cada MAC
+# foi liberado), em paralelo. Retorna {mac: (sucesso, mensagem)}.
+def remove_macs_on_routers(mac_addresses, site=None, only_due=False):
+    groups = registry.group(mac_addresses, expiry_scheduler.router_of, site)
+    return _per_router(lambda gateway, macs: _remove_bindings_on(gateway, macs, only_due),
+                       groups, "Erro ao remover MAC do IP Binding")
+
+
+# Callback do agendador de expirações; retorna a lista de MACs que não estão mais
+# no IP Binding.
+def remove_macs_from_ip_binding(mac_addresses):
+    try:
+        results = remove_macs_on_routers(mac_addresses, only_due=True)
+    except Exception as e:
+        log.error("Erro ao remover MACs do IP Binding", extra={'error': str(e)})
+        return []
+    removed = [mac for mac, (ok, _) in results.items() if ok]
+    log.info("Expirações processadas", extra={'removed': len(removed), 'total': len(mac_addresses)})
+    return removed
 
 
-# Remover MAC do IP Binding
-def remove_mac_from_ip_binding(mac_address):
-    api = mikrotik_connect()
-    if not api:
-        print(f"Erro ao conectar ao MikroTik para remover MAC {mac_address}.")
-        return
+def _load_index(gateway):
+    with router_session(gateway, READ) as api:
+        gateway.index.load(api)
 
-    try:
-        # Buscar o MAC no IP Binding e remover
-        ip_bindings = api('/ip/hotspot/ip-binding/print')
-        for binding in ip_bindings:
-            if binding['mac-address'] == mac_address:
-                api('/ip/hotspot/ip-binding/remove', **{'.id': binding['.id']})
-                print(f"MAC {mac_address} removido do IP Binding.")
-                break
-    except Exception as e:
-        print(f"Erro ao remover MAC {mac_address} do IP Binding: {e}")
-    
+
+# Na inicialização, descarta as expirações de MACs que já não estão no roteador.
+# Expirações vencidas durante a parada são executadas assim que o agendador inicia.
+def reconcile_expiries():
+    pending = expiry_scheduler.pending()
+    if not pending:
+        return
+    groups = registry.group(pending, expiry_scheduler.router_of)
+    futures = {gateway: router_executors[gateway].submit(_load_index, gateway) for gateway in groups}
+    for gateway, mac_addresses in groups.items():
+        error = futures[gateway].exception()
+        reconcile_gateway_expiries(expiry_scheduler, gateway, mac_addresses, error)
+
+
+# No modo 'router' o próprio MikroTik remove os bindings vencidos; o agendador só
+# descarta a cópia local das expirações, que serve para consulta (/expiries), e
+# tira do índice os MACs que não foram renovados
+def forget_expired(mac_addresses):
+    for mac_address in mac_addresses:
+        with mac_locks.hold(mac_address):
+            if expiry_scheduler.is_due(mac_address):
+                registry.locate(mac_address, expiry_scheduler.router_of).index.discard(mac_address)
+    log.info("Expirações encerradas (remoção feita pelo roteador)", extra={'count': len(mac_addresses)})
+    return mac_addresses
+
+
+def _install_sweep(gateway):
+    with router_session(gateway, ADD) as api:
+        changes = install_sweep(api, EXPIRY_SWEEP_INTERVAL)
+    if changes:
+        log.info("Varredura de expirações instalada no roteador", extra={'router': gateway.name})
+
+
+# Instala a varredura em todos os roteadores; um roteador fora do ar não impede a
+# inicialização (a instalação é repetida no próximo início)
+def install_router_sweeps():
+    futures = {gateway: router_executors[gateway].submit(_install_sweep, gateway) for gateway in registry}
+    for gateway, future in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            log.error("Erro ao instalar a varredura de expirações", extra={'router': gateway.name, 'error': str(e)})
+
+
+# Agendador único das remoções (substitui uma threading.Timer por MAC)
+expiry_scheduler = ExpiryScheduler(
+    ExpiryStore(EXPIRY_DB_PATH),
+    forget_expired if EXPIRY_MODE == 'router' else remove_macs_from_ip_binding,
+    batch_window=EXPIRY_BATCH_WINDOW, retry_delay=EXPIRY_RETRY_DELAY,
+)
+expiry_scheduler.load()
+EXPIRIES_PENDING.set_function(expiry_scheduler.pending_count)
+if EXPIRY_MODE == 'router':
+    install_router_sweeps()
+else:
+    reconcile_expiries()
+expiry_scheduler.start()
+atexit.register(expiry_scheduler.stop)
+
+
+# Fila durável das notificações do Mercado Pago, consumida pelo worker de pagamentos
+payment_store = PaymentEventStore(PAYMENT_DB_PATH)
+
+
+# Registra a notificação e acorda o worker. Retorna False para entregas repetidas.
+def record_payment_event(payment_id, action):
+    queued = payment_store.record(payment_id, action)
+    if queued:
+        payment_worker.notify()
+    return queued
+
+
+# Liberação de um pagamento (worker): fora de add_flights, que juntaria duas compras
+# idênticas simultâneas em uma única renovação. `on_lease` grava o prazo alvo.
+def release_payment(mac_address, duration, on_lease):
+    return _grant(registry.route(mac_address), mac_address, duration, on_lease)
+
+
+# Consulta o roteador do MAC (não o índice) para saber o prazo vigente (ver service.current_lease)
+def current_expiry(mac_address):
+    gateway = registry.locate(mac_address, expiry_scheduler.router_of)
+    with router_session(gateway, READ) as api:
+        rows = tuple(api.rawCmd('/ip/hotspot/ip-binding/print', f'?mac-address={mac_address}'))
+    gateway.index.remember(mac_address, rows)
+    return current_lease(expiry_scheduler, mac_address, rows)
+
+
+payment_worker = PaymentWorker(
+    payment_store, lambda payment_id: fetch_mercadopago_payment(payment_id, MP_ACCESS_TOKEN),
+    release_payment, current_expiry, max_attempts=PAYMENT_MAX_ATTEMPTS,
+)
+if MP_ACCESS_TOKEN:
+    payment_worker.start()
+    atexit.register(payment_worker.stop)
+else:
+    log.warning("MP_ACCESS_TOKEN não configurado: notificações ficam na fila até a configuração.")
 
 
 # Endpoint para mover MAC para VLAN Irrestrita
 @app.route('/add_mac', methods=['POST'])
 def add_mac():
     data = request.json
-    print(f"Requisição recebida: {data}")  # Log da requisição recebida
+    log.debug("Requisição recebida", extra={'body': data})
 
-    mac_address = data.get('mac_address')
-    duration = data.get('duration')  # Tempo em segundos enviado na requisição
-
-    if not mac_address:
-        return jsonify({"success": False, "message": "O campo 'mac_address' é obrigatório."}), 400
-
-    if not duration or not isinstance(duration, int) or duration <= 0:
-        return jsonify({"success": False, "message": "O campo 'duration' deve ser um número inteiro maior que zero."}), 400
+    mac_address, duration, error = parse_add(data)
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+    try:
+        gateway = registry.route(mac_address, request_site(data))
+    except LookupError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
 
-    success, message = add_mac_to_ip_binding(mac_address, duration)
+    success, message = add_mac_to_ip_binding(mac_address, duration, gateway)
     status_code = 200 if success else 500
     return jsonify({"success": success, "message": message}), status_code
 
@@ -139,18 +539,112 @@ def add_mac():
 @app.route('/remove_mac', methods=['POST'])
 def remove_mac():
     data = request.json
-    mac_address = data.get('mac_address')
+    mac_address, error = parse_remove(data)
+    if error:
+        return jsonify({"success": False, "message": error}), 400
 
-    if not mac_address:
-        return jsonify({"success": False, "message": "O campo 'mac_address' é obrigatório."}), 400
+    try:
+        gateway = registry.locate(mac_address, expiry_scheduler.router_of, request_site(data))
+    except LookupError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
 
     try:
-        remove_mac_from_ip_binding(mac_address)
+        remove_mac_from_ip_binding(mac_address, gateway)
         return jsonify({"success": True, "message": f"MAC {mac_address} removido com sucesso."}), 200
+    except AdmissionError:
+        raise
     except Exception as e:
         return jsonify({"success": False, "message": f"Erro ao remover MAC: {e}"}), 500
 
 
-# Iniciar o servidor Flask
+# Endpoint para mover vários MACs para VLAN Irrestrita de uma vez
+# Corpo: {"entries": [{"mac_address": "...", "duration": 3600}, ...], "site": "..." (opcional)}
+@app.route('/add_macs', methods=['POST'])
+def add_macs():
+    data = request.get_json(silent=True)
+    template, valid, error = parse_batch_add(data, BATCH_MAX_ENTRIES)
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+
+    try:
+        outcome = add_macs_to_ip_binding(valid, request_site(data)) if valid else {}
+    except LookupError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Erro ao adicionar MACs ao IP Binding: {e}"}), 500
+    return jsonify(batch_body(template, outcome)), 200
+
+
+# Endpoint para remover vários MACs do IP Binding de uma vez
+# Corpo: {"entries": [{"mac_address": "..."}, ...], "site": "..." (opcional)}
+@app.route('/remove_macs', methods=['POST'])
+def remove_macs():
+    data = request.get_json(silent=True)
+    template, valid, error = parse_batch_remove(data, BATCH_MAX_ENTRIES)
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+
+    try:
+        outcome = remove_macs_on_routers(valid, request_site(data)) if valid else {}
+    except LookupError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Erro ao remover MACs: {e}"}), 500
+    return jsonify(batch_body(template, outcome)), 200
+
+
+# Estatísticas do pool de conexões de cada roteador, para dimensionar POOL_SIZE
+@app.route('/pool_stats', methods=['GET'])
+def pool_stats():
+    return jsonify({gateway.name: gateway.client.stats() for gateway in registry}), 200
+
+
+# Estatísticas do índice de MACs de cada roteador (acertos, consultas ao roteador, tamanho)
+@app.route('/index_stats', methods=['GET'])
+def index_stats():
+    return jsonify({gateway.name: gateway.index.stats() for gateway in registry}), 200
+
+
+# Entradas do IP Binding servidas da cópia local, sem consultar o roteador. Filtros
+# ?mac= (exato), ?comment= (trecho) e ?router=; paginação com ?offset= e ?limit=.
+# Com ?format=ndjson (ou Accept: application/x-ndjson) envia todas as entradas
+# filtradas, uma por linha, sem montar a resposta inteira na memória.
+@app.route('/bindings', methods=['GET'])
+def bindings():
+    query, error = parse_bindings_query(request.args, request.headers.get('Accept', ''))
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+    gateways, error = bindings_gateways(registry, query, BINDING_CACHE)
+    if error:
+        return jsonify(error[0]), error[1]
+    if query['ndjson']:
+        return Response(bindings_ndjson(gateways, query), mimetype='application/x-ndjson')
+    return jsonify(bindings_page(gateways, query)), 200
+
+
+# Expirações pendentes (MAC, instante de expiração e roteador), da mais próxima à mais distante
+@app.route('/expiries', methods=['GET'])
+def expiries():
+    return jsonify(expiries_body(expiry_scheduler, EXPIRY_MODE)), 200
+
+
+# Saúde de cada roteador (falhas de conexão seguidas, espera de reconexão, pool, índice
+# e fila de admissão). Responde 503 quando algum roteador está com falha.
+@app.route('/routers', methods=['GET'])
+def routers():
+    health, status_code = routers_health(registry)
+    return jsonify(health), status_code
+
+
+# Métricas no formato do Prometheus: latência por comando do RouterOS e por endpoint,
+# tempo de conexão e login, expirações pendentes e erros por tipo
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return app.response_class(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+# Iniciar o servidor Flask. Sem o reloader do modo debug: ele importa o módulo de novo
+# em um processo filho e haveria dois agendadores de expiração (e dois workers de
+# pagamento, pools e seguidores), cada um com sua própria fila em memória.
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
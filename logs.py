@@ -0,0 +1,60 @@
+import atexit, copy, json, logging, logging.handlers, os, queue
+
+# Logs estruturados (uma linha JSON por registro) sem bloquear quem registra: os
+# handlers só colocam o registro em uma fila e uma thread própria formata e escreve.
+# Campos extras vão em extra={...}, ex: log.info("MAC removido", extra={'mac': mac}).
+
+# Atributos padrão de um LogRecord; os demais vieram de extra={...}
+_STANDARD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_FIELDS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# O QueueHandler padrão formata o registro antes da fila e junta o traceback à
+# mensagem. Aqui só a mensagem (com os argumentos) e o texto do traceback são
+# resolvidos na thread de quem registra; o JsonFormatter põe o traceback em 'exc'.
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# Configura o logger raiz uma única vez. Nível em LOG_LEVEL (padrão INFO); em DEBUG
+# os corpos das requisições também são registrados.
+def setup_logging(level=None):
+    global _listener
+    if _listener is not None:
+        return
+    log_queue = queue.Queue(-1)
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.handlers[:] = [_QueueHandler(log_queue)]
+    root.setLevel((level or os.getenv('LOG_LEVEL', 'INFO')).upper())
+    _listener.start()
+    atexit.register(_listener.stop)
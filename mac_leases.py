@@ -0,0 +1,175 @@
+from contextlib import contextmanager
+import asyncio, threading, time
+
+# Liberação de MAC como concessão (lease) com prazo: liberar um MAC que já está no IP
+# Binding renova o prazo em vez de falhar. Cada MAC é alterado por uma operação de
+# cada vez (liberação, renovação, remoção ou expiração) e liberações idênticas em
+# andamento (retentativas do cliente) são agrupadas em uma só escrita no roteador.
+
+# 'extend': o tempo comprado soma ao que resta; 'replace': o prazo passa a contar de agora
+LEASE_MODES = ('extend', 'replace')
+
+
+# Novo instante de expiração de uma liberação de `duration` segundos, dado o prazo
+# vigente do MAC (None se o MAC não tem liberação ativa)
+def lease_expiry(current, duration, mode='extend', now=None):
+    now = time.time() if now is None else now
+    if mode == 'extend' and current and current > now:
+        return current + duration
+    return now + duration
+
+
+# Locks por MAC, criados sob demanda e descartados quando ninguém mais os usa.
+# Vários MACs são travados em ordem, para que dois lotes não se bloqueiem mutuamente.
+class MacLocks:
+    def __init__(self):
+        self._locks = {}   # mac -> [lock, usuários]
+        self._lock = threading.Lock()
+
+    def _enter(self, mac_address):
+        with self._lock:
+            entry = self._locks.setdefault(mac_address, [threading.Lock(), 0])
+            entry[1] += 1
+        entry[0].acquire()
+
+    def _exit(self, mac_address):
+        with self._lock:
+            entry = self._locks[mac_address]
+            entry[0].release()
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[mac_address]
+
+    @contextmanager
+    def hold(self, *mac_addresses):
+        held = []
+        try:
+            for mac_address in sorted(set(mac_addresses)):
+                self._enter(mac_address)
+                held.append(mac_address)
+            yield
+        finally:
+            for mac_address in reversed(held):
+                self._exit(mac_address)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._locks)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Agrupa chamadas simultâneas com a mesma chave: só a primeira executa `fn` e as
+# demais esperam e recebem o mesmo resultado (ou a mesma exceção).
+# `on_coalesced()` é chamado a cada chamada agrupada (ex: para uma métrica).
+class SingleFlight:
+    def __init__(self, on_coalesced=None):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.on_coalesced = on_coalesced
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if self.on_coalesced:
+                self.on_coalesced()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+# Versões para o servidor assíncrono; devem ser usadas dentro do loop
+class AsyncMacLocks:
+    def __init__(self):
+        self._locks = {}   # mac -> [lock, usuários]
+
+    async def _enter(self, mac_address):
+        entry = self._locks.setdefault(mac_address, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._release_entry(mac_address, entry, locked=False)
+            raise
+
+    def _release_entry(self, mac_address, entry, locked=True):
+        if locked:
+            entry[0].release()
+        entry[1] -= 1
+        if not entry[1]:
+            del self._locks[mac_address]
+
+    def hold(self, *mac_addresses):
+        return _AsyncHold(self, sorted(set(mac_addresses)))
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class _AsyncHold:
+    def __init__(self, locks, mac_addresses):
+        self.locks = locks
+        self.mac_addresses = mac_addresses
+        self.held = []
+
+    async def __aenter__(self):
+        try:
+            for mac_address in self.mac_addresses:
+                await self.locks._enter(mac_address)
+                self.held.append(mac_address)
+        except BaseException:
+            await self.__aexit__(None, None, None)
+            raise
+
+    async def __aexit__(self, *exc_info):
+        for mac_address in reversed(self.held):
+            self.locks._release_entry(mac_address, self.locks._locks[mac_address])
+        self.held = []
+
+
+class AsyncSingleFlight:
+    def __init__(self, on_coalesced=None):
+        self._calls = {}
+        self.on_coalesced = on_coalesced
+
+    async def do(self, key, factory):
+        call = self._calls.get(key)
+        if call is not None:
+            if self.on_coalesced:
+                self.on_coalesced()
+            return await asyncio.shield(call)
+        call = self._calls[key] = asyncio.ensure_future(factory())
+        try:
+            return await asyncio.shield(call)
+        finally:
+            if call.done():
+                self._calls.pop(key, None)
+            else:
+                # quem iniciou foi cancelado (ex: tempo limite da requisição); a escrita
+                # segue para os demais e a chave é liberada ao terminar
+                call.add_done_callback(lambda done: self._forget(key, done))
+
+    def _forget(self, key, call):
+        self._calls.pop(key, None)
+        if not call.cancelled():
+            call.exception()  # evita o aviso de exceção não lida quando ninguém mais espera
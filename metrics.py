@@ -0,0 +1,168 @@
+import bisect, threading
+
+# Métricas no formato texto do Prometheus, servidas em /metrics pelos dois servidores.
+# Implementação mínima (contadores, gauges e histogramas com rótulos), sem dependências.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Rótulos de {self.name} devem ser {self.labels}, recebidos {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+# Gauge com valor definido diretamente ou lido de uma função no momento da coleta
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), registry=None):
+        super().__init__(name, documentation, labels, registry)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def render(self):
+        if self._function is not None:
+            try:
+                self.set(self._function())
+            except Exception:
+                pass
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, labels, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[position] += 1
+            self._values[key] = (counts, total + value)
+
+    def _render_value(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            labels = _format_labels(self.labels, key, [('le', _format_value(float(bound)))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labels, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+ROUTEROS_COMMAND_SECONDS = Histogram(
+    'routeros_command_duration_seconds', 'Tempo de resposta dos comandos na API do RouterOS',
+    ['router', 'command'])
+ROUTEROS_CONNECT_SECONDS = Histogram(
+    'routeros_connect_duration_seconds', 'Tempo de conexão e login na API do RouterOS', ['router'])
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Tempo de resposta dos endpoints HTTP',
+    ['endpoint', 'method', 'status'])
+EXPIRIES_PENDING = Gauge('expiries_pending', 'Expirações de MAC pendentes')
+ERRORS = Counter('errors_total', 'Erros por tipo', ['kind'])
+ROUTER_QUEUE_DEPTH = Gauge(
+    'router_queue_depth', 'Operações esperando vez na fila de admissão de cada roteador', ['router', 'priority'])
+ROUTER_QUEUE_WAIT = Histogram(
+    'router_queue_wait_seconds', 'Espera na fila de admissão antes de chegar ao roteador', ['router', 'priority'])
+ROUTER_IN_FLIGHT = Gauge('router_in_flight', 'Operações em andamento em cada roteador', ['router'])
+LEASES = Counter('mac_leases_total', 'Liberações de MAC por resultado (added, renewed, coalesced)', ['outcome'])
+
+
+# Nome curto e de cardinalidade limitada de um comando (ex: /ip/hotspot/ip-binding/add -> ip-binding/add)
+def command_name(cmd):
+    return '/'.join(cmd.strip('/').split('/')[-2:])
+
+
+def observe_command(router, cmd, seconds):
+    ROUTEROS_COMMAND_SECONDS.observe(seconds, router=router, command=command_name(cmd))
+
+
+# Tempo de uma requisição HTTP por endpoint (a regra da rota, não a URL, para limitar
+# os rótulos); respostas 5xx também contam como erro
+def observe_http(endpoint, method, status, seconds):
+    HTTP_REQUEST_SECONDS.observe(seconds, endpoint=endpoint or 'desconhecido', method=method, status=status)
+    if status >= 500:
+        ERRORS.inc(kind='http_5xx')
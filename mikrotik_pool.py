@@ -0,0 +1,291 @@
+from librouteros import connect
+from librouteros.api import Api
+from librouteros.exceptions import TrapError, MultiTrapError
+from metrics import ROUTEROS_CONNECT_SECONDS, ERRORS, observe_command
+from contextlib import contextmanager
+import threading, time
+
+# Erros de comando (!trap) não invalidam a sessão; qualquer outro erro durante o
+# uso de uma conexão é tratado como sessão quebrada e a conexão é descartada.
+COMMAND_ERRORS = (TrapError, MultiTrapError)
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class PoolClosed(Exception):
+    pass
+
+
+# Sessão da librouteros que mede o tempo de cada comando (até o !done) por roteador
+class TimedApi(Api):
+    router = ''
+
+    def _timed(self, cmd, response):
+        started = time.perf_counter()
+        try:
+            yield from response
+        except COMMAND_ERRORS:
+            ERRORS.inc(kind='routeros_trap')
+            raise
+        except Exception:
+            ERRORS.inc(kind='routeros_connection')
+            raise
+        finally:
+            if cmd != '/login':  # o login entra no tempo de conexão
+                observe_command(self.router, cmd, time.perf_counter() - started)
+
+    def __call__(self, cmd, **kwargs):
+        return self._timed(cmd, super().__call__(cmd, **kwargs))
+
+    def rawCmd(self, cmd, *words):
+        return self._timed(cmd, super().rawCmd(cmd, *words))
+
+    # Usado por routeros_pipeline.pipeline(), que escreve as sentenças direto no protocolo
+    def observe(self, cmd, seconds, trapped=False):
+        if trapped:
+            ERRORS.inc(kind='routeros_trap')
+        observe_command(self.router, cmd, seconds)
+
+
+class _PooledConnection:
+    def __init__(self, api):
+        self.api = api
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.last_checked = self.created_at
+
+
+# Pool de sessões da API RouterOS compartilhado entre os handlers Flask e os
+# callbacks de expiração. Mantém no máximo `max_size` sessões abertas, reaproveita
+# sessões ociosas, verifica a saúde das que ficaram paradas, reconecta com backoff
+# exponencial e fecha as que ficaram ociosas por mais de `max_idle` segundos.
+class MikrotikPool:
+    def __init__(self, host, username, password, port=8728, max_size=4,
+                 acquire_timeout=10, connect_timeout=10, max_idle=300,
+                 health_check_interval=30, backoff_base=0.5, backoff_max=30,
+                 reap_interval=30, encoding='latin-1', name=None):
+        self.name = name or host  # rótulo do roteador nas métricas
+        self.host = host
+        self.username = username
+        self.password = password
+        self.port = port
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.connect_timeout = connect_timeout
+        self.max_idle = max_idle
+        self.health_check_interval = health_check_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # O RouterOS grava textos (ex: comentários com acento) em latin-1; a librouteros usa ASCII por padrão
+        self.encoding = encoding
+
+        self._idle = []  # pilha LIFO: a conexão mais recente é reutilizada primeiro
+        self._in_use = 0
+        self._connecting = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # Estado do backoff de reconexão
+        self._consecutive_failures = 0
+        self._next_attempt = 0.0
+
+        self._stats = {
+            'connections_created': 0,
+            'connections_closed': 0,
+            'connect_failures': 0,
+            'health_check_failures': 0,
+            'idle_evictions': 0,
+            'broken_discarded': 0,
+            'acquires': 0,
+            'acquire_timeouts': 0,
+            'acquire_wait_total': 0.0,
+            'acquire_wait_max': 0.0,
+        }
+
+        self._reaper_stop = threading.Event()
+        self._reaper = threading.Thread(target=self._reap_loop, args=(reap_interval,),
+                                        name='mikrotik-pool-reaper', daemon=True)
+        self._reaper.start()
+
+    # Abre uma nova sessão respeitando o backoff após falhas consecutivas
+    def _open(self):
+        wait = self._next_attempt - time.monotonic()
+        if wait > 0:
+            raise ConnectionError(
+                f"Reconexão ao MikroTik em backoff por mais {wait:.1f} segundos")
+        started = time.perf_counter()
+        try:
+            api = connect(username=self.username, password=self.password,
+                          host=self.host, port=self.port, timeout=self.connect_timeout,
+                          encoding=self.encoding, subclass=TimedApi)
+        except Exception:
+            ERRORS.inc(kind='routeros_connect')
+            with self._cond:
+                self._consecutive_failures += 1
+                self._stats['connect_failures'] += 1
+                delay = min(self.backoff_max,
+                            self.backoff_base * (2 ** (self._consecutive_failures - 1)))
+                self._next_attempt = time.monotonic() + delay
+            raise
+        ROUTEROS_CONNECT_SECONDS.observe(time.perf_counter() - started, router=self.name)
+        api.router = self.name
+        with self._cond:
+            self._consecutive_failures = 0
+            self._next_attempt = 0.0
+            self._stats['connections_created'] += 1
+        return _PooledConnection(api)
+
+    def _close_conn(self, conn):
+        try:
+            conn.api.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._stats['connections_closed'] += 1
+
+    # Comando barato usado para confirmar que uma sessão parada ainda responde
+    def _is_healthy(self, conn):
+        try:
+            tuple(conn.api('/system/identity/print'))
+            conn.last_checked = time.monotonic()
+            return True
+        except Exception:
+            with self._cond:
+                self._stats['health_check_failures'] += 1
+            return False
+
+    def acquire(self, timeout=None):
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolClosed("Pool de conexões do MikroTik encerrado")
+                    if self._idle:
+                        conn = self._idle.pop()
+                        self._in_use += 1
+                        break
+                    if self._in_use + self._connecting + len(self._idle) < self.max_size:
+                        self._connecting += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['acquire_timeouts'] += 1
+                        ERRORS.inc(kind='pool_exhausted')
+                        raise PoolExhausted(
+                            f"Nenhuma conexão livre com o MikroTik após {timeout} segundos")
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self._cond:
+                        self._connecting -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._connecting -= 1
+                    self._in_use += 1
+            elif time.monotonic() - conn.last_checked > self.health_check_interval \
+                    and not self._is_healthy(conn):
+                # Sessão morta: descarta e tenta novamente com outra
+                self._close_conn(conn)
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                continue
+
+            waited = time.monotonic() - started
+            with self._cond:
+                self._stats['acquires'] += 1
+                self._stats['acquire_wait_total'] += waited
+                self._stats['acquire_wait_max'] = max(self._stats['acquire_wait_max'], waited)
+            return conn
+
+    def release(self, conn, broken=False):
+        with self._cond:
+            self._in_use -= 1
+            if broken or self._closed:
+                if broken:
+                    self._stats['broken_discarded'] += 1
+                discard = True
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.append(conn)
+                discard = False
+            self._cond.notify()
+        if discard:
+            self._close_conn(conn)
+
+    # Sessão avulsa, fora do pool (não conta em max_size), para comandos que prendem a
+    # sessão por tempo indeterminado, como o listen da cópia do IP Binding. Quem abre fecha.
+    def open_session(self):
+        return self._open().api
+
+    # Uso: `with pool.connection() as api: tuple(api('/ip/hotspot/ip-binding/print'))`
+    # As respostas da librouteros são geradores: consuma cada resposta por completo
+    # (tuple/list) antes do próximo comando, senão a sessão devolvida fica dessincronizada.
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn.api
+        except COMMAND_ERRORS:
+            self.release(conn)
+            raise
+        except BaseException:
+            self.release(conn, broken=True)
+            raise
+        else:
+            self.release(conn)
+
+    # Fecha sessões ociosas há mais de `max_idle` segundos
+    def evict_idle(self):
+        now = time.monotonic()
+        with self._cond:
+            expired = [c for c in self._idle if now - c.last_used > self.max_idle]
+            self._idle = [c for c in self._idle if now - c.last_used <= self.max_idle]
+            self._stats['idle_evictions'] += len(expired)
+        for conn in expired:
+            self._close_conn(conn)
+        return len(expired)
+
+    def _reap_loop(self, interval):
+        while not self._reaper_stop.wait(interval):
+            self.evict_idle()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        self._reaper_stop.set()
+        for conn in idle:
+            self._close_conn(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'host': self.host,
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'connecting': self._connecting,
+                'open': self._in_use + len(self._idle),
+                'consecutive_failures': self._consecutive_failures,
+                'backoff_remaining': max(0.0, self._next_attempt - time.monotonic()),
+                'closed': self._closed,
+            })
+        if stats['acquires']:
+            stats['acquire_wait_avg'] = stats['acquire_wait_total'] / stats['acquires']
+        else:
+            stats['acquire_wait_avg'] = 0.0
+        return stats
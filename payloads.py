@@ -0,0 +1,156 @@
+from binding_index import normalize_mac
+
+# Validação dos corpos de requisição, compartilhada pelo servidor Flask
+# (liberaçãomikrotik.py) e pelo servidor assíncrono (servidor_async.py) para que
+# os dois mantenham exatamente o mesmo contrato.
+
+MAC_REQUIRED = "O campo 'mac_address' é obrigatório."
+DURATION_INVALID = "O campo 'duration' deve ser um número inteiro maior que zero."
+
+
+def _valid_duration(duration):
+    return bool(duration) and isinstance(duration, int) and duration > 0
+
+
+# Corpo de /add_mac. Retorna (mac, duração, erro)
+def parse_add(data):
+    data = data if isinstance(data, dict) else {}
+    mac_address = data.get('mac_address')
+    duration = data.get('duration')  # Tempo em segundos enviado na requisição
+
+    if not mac_address:
+        return None, None, MAC_REQUIRED
+    try:
+        mac_address = normalize_mac(mac_address)
+    except ValueError as e:
+        return None, None, str(e)
+    if not _valid_duration(duration):
+        return None, None, DURATION_INVALID
+    return mac_address, duration, None
+
+
+# Corpo de /remove_mac. Retorna (mac, erro)
+def parse_remove(data):
+    data = data if isinstance(data, dict) else {}
+    mac_address = data.get('mac_address')
+
+    if not mac_address:
+        return None, MAC_REQUIRED
+    try:
+        return normalize_mac(mac_address), None
+    except ValueError as e:
+        return None, str(e)
+
+
+def batch_result(mac_address, success, message):
+    return {"mac_address": mac_address, "success": success, "message": message}
+
+
+def _batch_entries(data, max_entries):
+    entries = data.get('entries') if isinstance(data, dict) else None
+    if not isinstance(entries, list) or not entries:
+        return None, "O campo 'entries' deve ser uma lista não vazia."
+    if len(entries) > max_entries:
+        return None, f"O campo 'entries' aceita no máximo {max_entries} itens."
+    return entries, None
+
+
+# Corpo de /add_macs: {"entries": [{"mac_address": "...", "duration": 3600}, ...]}
+# Retorna (modelo, válidas, erro): o modelo tem um item por entrada, já com o
+# resultado das inválidas e o MAC normalizado no lugar das válidas; `válidas` é
+# a lista [(mac, duração)] sem repetições.
+def parse_batch_add(data, max_entries):
+    entries, error = _batch_entries(data, max_entries)
+    if error:
+        return None, None, error
+
+    template = []
+    valid = []
+    seen = set()
+    for entry in entries:
+        entry = entry if isinstance(entry, dict) else {}
+        mac_address = entry.get('mac_address')
+        duration = entry.get('duration')
+        try:
+            mac_address = normalize_mac(mac_address)
+        except ValueError as e:
+            template.append(batch_result(mac_address, False, str(e)))
+            continue
+        if not _valid_duration(duration):
+            template.append(batch_result(mac_address, False, DURATION_INVALID))
+        elif mac_address in seen:
+            template.append(batch_result(mac_address, False, f"MAC {mac_address} repetido no lote."))
+        else:
+            seen.add(mac_address)
+            valid.append((mac_address, duration))
+            template.append(mac_address)
+    return template, valid, None
+
+
+# Corpo de /remove_macs: {"entries": [{"mac_address": "..."}, ...]}
+# Retorna (modelo, MACs válidos sem repetição, erro)
+def parse_batch_remove(data, max_entries):
+    entries, error = _batch_entries(data, max_entries)
+    if error:
+        return None, None, error
+
+    template = []
+    valid = []
+    for entry in entries:
+        entry = entry if isinstance(entry, dict) else {}
+        try:
+            mac_address = normalize_mac(entry.get('mac_address'))
+        except ValueError as e:
+            template.append(batch_result(entry.get('mac_address'), False, str(e)))
+            continue
+        if mac_address not in valid:
+            valid.append(mac_address)
+        template.append(mac_address)
+    return template, valid, None
+
+
+# Preenche o modelo com {mac: (sucesso, mensagem)} e monta o corpo da resposta do lote
+def batch_body(template, outcome):
+    results = [batch_result(item, *outcome[item]) if isinstance(item, str) else item
+               for item in template]
+    return {"success": all(result['success'] for result in results), "results": results}
+
+
+# Corpo de /payment-notification (Mercado Pago).
+# Retorna (ação, tipo, id do pagamento, erro)
+def parse_payment_notification(data):
+    if not data or not isinstance(data, dict):
+        return None, None, None, "Nenhum dado enviado"
+
+    action = data.get("action")  # Ação realizada (ex: payment.updated)
+    notification_type = data.get("type")  # Tipo da notificação (ex: payment)
+    payload = data.get("data")
+    payment_id = payload.get("id") if isinstance(payload, dict) else None  # ID do pagamento
+
+    if not action or not notification_type or not payment_id:
+        return action, notification_type, payment_id, "Dados incompletos"
+    return action, notification_type, payment_id, None
+
+
+# Parâmetros de GET /bindings (?mac=&comment=&router=&offset=&limit=&format=ndjson).
+# Retorna (consulta, erro); em NDJSON todas as linhas filtradas são enviadas, sem paginação.
+def parse_bindings_query(args, accept='', default_limit=100, max_limit=1000):
+    query = {
+        'mac': args.get('mac') or None,
+        'comment': args.get('comment') or None,
+        'router': args.get('router') or None,
+        'ndjson': args.get('format') == 'ndjson' or 'application/x-ndjson' in (accept or ''),
+    }
+    if query['mac']:
+        try:
+            query['mac'] = normalize_mac(query['mac'])
+        except ValueError as e:
+            return None, str(e)
+    try:
+        query['offset'] = int(args.get('offset', 0))
+        query['limit'] = int(args.get('limit', default_limit))
+    except (TypeError, ValueError):
+        return None, "Os parâmetros 'offset' e 'limit' devem ser números inteiros."
+    if query['offset'] < 0 or not 0 < query['limit'] <= max_limit:
+        return None, f"Use 'offset' >= 0 e 'limit' entre 1 e {max_limit}."
+    return query, None
@@ -0,0 +1,84 @@
+from routeros_reconciler import reconcile
+import re
+
+# Expiração feita pelo próprio RouterOS (EXPIRY_MODE=router).
+#
+# O comentário de cada binding leva o instante de expiração em segundos desde a
+# época ("... expira=1760000000") e um script instalado no roteador, executado
+# pelo /system/scheduler a cada `interval` segundos, remove os bindings vencidos.
+# Assim nenhuma remoção depende do serviço estar no ar. Requer RouterOS v7
+# (:timestamp) e o relógio do roteador sincronizado (NTP).
+
+# 'app': o serviço remove os MACs vencidos; 'router': a varredura abaixo
+EXPIRY_MODES = ('app', 'router')
+
+SWEEP_NAME = 'expirar-ip-bindings'
+EXPIRY_TAG = 'expira='
+# Início do comentário de todo binding criado pelo serviço, nos dois modos; a
+# varredura só considera o EXPIRY_TAG
+COMMENT_PREFIX = 'Acesso temporário VLAN Irrestrita ('
+
+_EXPIRY_IN_COMMENT = re.compile(EXPIRY_TAG + r'(\d+)')
+
+SWEEP_SOURCE = f''':local now [:tonum [:timestamp]]
+:foreach b in=[/ip hotspot ip-binding find where comment~"{EXPIRY_TAG}[0-9]+"] do={{
+    :local c [/ip hotspot ip-binding get $b comment]
+    :local p ([:find $c "{EXPIRY_TAG}"] + {len(EXPIRY_TAG)})
+    :if ([:tonum [:pick $c $p [:len $c]]] <= $now) do={{
+        /ip hotspot ip-binding remove $b
+    }}
+}}'''
+
+
+# Comentário do binding; com `expires_at`, inclui a expiração lida pelo script do roteador
+def binding_comment(duration, expires_at=None):
+    comment = f'{COMMENT_PREFIX}{duration} segundos)'
+    if expires_at is not None:
+        comment += f' {EXPIRY_TAG}{int(expires_at)}'
+    return comment
+
+
+# Se o comentário é de um binding criado pelo serviço (em qualquer modo de expiração)
+def service_comment(comment):
+    return bool(comment) and (comment.startswith(COMMENT_PREFIX) or comment_expiry(comment) is not None)
+
+
+# Instante de expiração gravado no comentário, ou None
+def comment_expiry(comment):
+    match = _EXPIRY_IN_COMMENT.search(comment or '')
+    return int(match.group(1)) if match else None
+
+
+# Intervalo no formato em que o RouterOS o exibe (ex: 90 -> 1m30s), para que o
+# reconciliador não veja diferença a cada execução
+def _routeros_interval(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    parts = [f'{value}{unit}' for value, unit in ((hours, 'h'), (minutes, 'm'), (seconds, 's')) if value]
+    return ''.join(parts) or '0s'
+
+
+# Estado desejado do script de varredura e do agendamento que o executa. Com
+# `enabled` falso (EXPIRY_MODE=app) os dois são removidos, se existirem: o
+# agendamento antes do script, para não executar um script que já não existe.
+def sweep_state(interval=60, enabled=True):
+    if not enabled:
+        return [
+            {'path': '/system/scheduler', 'key': 'name', 'entries': [], 'absent': [{'name': SWEEP_NAME}]},
+            {'path': '/system/script', 'key': 'name', 'entries': [], 'absent': [{'name': SWEEP_NAME}]},
+        ]
+    return [
+        {'path': '/system/script', 'key': 'name', 'entries': [
+            {'name': SWEEP_NAME, 'policy': 'read,write,test', 'source': SWEEP_SOURCE},
+        ]},
+        {'path': '/system/scheduler', 'key': 'name', 'entries': [
+            {'name': SWEEP_NAME, 'interval': _routeros_interval(interval),
+             'policy': 'read,write,test', 'on-event': SWEEP_NAME},
+        ]},
+    ]
+
+
+# Instala (ou atualiza) a varredura em uma sessão aberta. Retorna as mudanças aplicadas.
+def install_sweep(api, interval=60):
+    return reconcile(api, sweep_state(interval))
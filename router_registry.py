@@ -0,0 +1,144 @@
+from binding_cache import BindingCache
+from binding_index import BindingIndex, normalize_mac
+import bisect, hashlib, json, os
+
+DEFAULT_ROUTER = 'default'
+
+
+# Anel de hash consistente: cada roteador ocupa `replicas` pontos do anel e uma
+# chave (o MAC) vai para o primeiro ponto à frente do seu hash. Incluir ou retirar
+# um roteador só remaneja as chaves daquele trecho do anel.
+class HashRing:
+    def __init__(self, names, replicas=100):
+        self._points = []
+        self._owners = {}
+        for name in names:
+            for i in range(replicas):
+                point = self._hash(f'{name}#{i}')
+                self._owners[point] = name
+                self._points.append(point)
+        self._points.sort()
+
+    @staticmethod
+    def _hash(value):
+        return int(hashlib.md5(value.encode()).hexdigest()[:16], 16)
+
+    def get(self, key):
+        if not self._points:
+            raise LookupError("Nenhum roteador configurado")
+        position = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[self._points[position]]
+
+
+# Um gateway MikroTik do registro: configuração, cliente da API (pool ou cliente
+# assíncrono, criado pela fábrica do servidor), a fila de admissão das operações
+# (admission.py, também criada pelo servidor), o índice de MACs e a cópia do IP
+# Binding daquele roteador.
+class Gateway:
+    def __init__(self, name, config, client, admission=None):
+        self.name = name
+        self.config = config
+        self.client = client
+        self.admission = admission
+        self.index = BindingIndex()
+        self.bindings = BindingCache()
+
+    def health(self):
+        stats = self.client.stats()
+        return {
+            'host': self.config['host'],
+            'port': self.config['port'],
+            'healthy': not stats.get('consecutive_failures') and not stats.get('backoff_remaining'),
+            'client': stats,
+            'index': self.index.stats(),
+            'bindings': self.bindings.stats(),
+            'admission': self.admission.stats() if self.admission else None,
+        }
+
+
+# Registro dos roteadores. Um MAC é direcionado, nesta ordem, pelo mapeamento
+# explícito de MACs, pelo mapeamento de sites (campo opcional 'site' das
+# requisições) ou pelo anel de hash consistente.
+class RouterRegistry:
+    def __init__(self, configs, factory, mac_map=None, site_map=None, replicas=100, admission=None):
+        self.gateways = {config['name']: Gateway(config['name'], config, factory(config),
+                                                 admission(config) if admission else None)
+                         for config in configs}
+        self.mac_map = {normalize_mac(mac): name for mac, name in (mac_map or {}).items()}
+        self.site_map = dict(site_map or {})
+        for name in list(self.mac_map.values()) + list(self.site_map.values()):
+            if name not in self.gateways:
+                raise ValueError(f"Roteador desconhecido no mapeamento: {name}")
+        self._ring = HashRing(sorted(self.gateways), replicas)
+
+    def __iter__(self):
+        return iter(self.gateways.values())
+
+    def __len__(self):
+        return len(self.gateways)
+
+    def get(self, name):
+        return self.gateways[name]
+
+    def route(self, mac_address, site=None):
+        mac = normalize_mac(mac_address)
+        if mac in self.mac_map:
+            return self.gateways[self.mac_map[mac]]
+        if site is not None:
+            if site not in self.site_map:
+                raise LookupError(f"Site desconhecido: {site}")
+            return self.gateways[self.site_map[site]]
+        return self.gateways[self._ring.get(mac)]
+
+    # Roteador de um MAC já liberado: o registrado na liberação (`router_of`, ex: o
+    # agendador de expirações), se ainda existir, ou o roteamento normal
+    def locate(self, mac_address, router_of=None, site=None):
+        name = router_of(mac_address) if router_of else None
+        if name in self.gateways:
+            return self.gateways[name]
+        return self.route(mac_address, site)
+
+    # Agrupa MACs por roteador: {gateway: [macs]}
+    def group(self, mac_addresses, router_of=None, site=None):
+        groups = {}
+        for mac in mac_addresses:
+            groups.setdefault(self.locate(mac, router_of, site), []).append(mac)
+        return groups
+
+    def health(self):
+        return {name: gateway.health() for name, gateway in self.gateways.items()}
+
+
+# Lê a lista de roteadores de ROUTERS_FILE (JSON) ou, sem o arquivo, usa o
+# roteador único de HOST/PORT/USERNAME/PASSWORD. Formato do arquivo:
+#   {"routers": [{"name": "gw1", "host": "10.0.0.1", "port": 8728,
+#                 "username": "api", "password": "...", "sites": ["centro"]}, ...],
+#    "macs": {"AA:BB:CC:DD:EE:FF": "gw1"}}
+# Retorna (configs, mapeamento de MACs, mapeamento de sites).
+def load_router_configs(environ=os.environ):
+    path = environ.get('ROUTERS_FILE')
+    if not path:
+        return [{
+            'name': DEFAULT_ROUTER,
+            'host': environ.get('HOST'),
+            'port': int(environ.get('PORT')),
+            'username': environ.get('USERNAME'),
+            'password': environ.get('PASSWORD'),
+        }], {}, {}
+
+    with open(path) as f:
+        data = json.load(f)
+    configs = []
+    site_map = {}
+    for router in data['routers']:
+        config = {
+            'name': router['name'],
+            'host': router['host'],
+            'port': int(router.get('port', 8728)),
+            'username': router.get('username', environ.get('USERNAME')),
+            'password': router.get('password', environ.get('PASSWORD')),
+        }
+        configs.append(config)
+        for site in router.get('sites', []):
+            site_map[site] = config['name']
+    return configs, data.get('macs', {}), site_map
@@ -0,0 +1,282 @@
+from librouteros.protocol import Encoder, Decoder, compose_word
+from librouteros.exceptions import TrapError, MultiTrapError, ConnectionClosed, FatalError
+from routeros_pipeline import parse_words
+from metrics import ROUTEROS_CONNECT_SECONDS, ERRORS, observe_command
+import asyncio, itertools, time
+
+
+class _PendingCommand:
+    def __init__(self, future, on_row=None):
+        self.future = future
+        self.on_row = on_row
+        self.rows = []
+        self.traps = []
+
+
+# Comando de resposta contínua aberto por AsyncRouterOS.stream
+class _Stream:
+    def __init__(self, client, tag, command):
+        self.client = client
+        self.tag = tag
+        self.command = command
+        self.future = command.future
+
+    # Lança o erro que encerrou o comando (queda da sessão ou !trap)
+    def result(self):
+        self.future.result()
+        if self.command.traps:
+            raise self.command.traps[0]
+
+    # Encerra o comando no roteador (/cancel); as respostas restantes são ignoradas
+    def cancel(self):
+        if self.client._pending.pop(self.tag, None) is not None and self.client.connected:
+            self.client._writer.write(self.client._encode_sentence('/cancel', f'=tag={self.tag}'))
+        if not self.future.done():
+            self.future.cancel()
+        elif not self.future.cancelled():
+            self.future.exception()  # erro da sessão já tratado por quem cancelou
+
+
+# Cliente assíncrono (asyncio) da API RouterOS. Uma única sessão atende vários
+# comandos ao mesmo tempo: cada sentença leva uma palavra .tag e uma tarefa de
+# leitura entrega as respostas ao comando correspondente, então um comando lento
+# não bloqueia os demais nem prende threads. Reconecta sob demanda com backoff
+# exponencial e limita os comandos em andamento a `max_in_flight`.
+class AsyncRouterOS:
+    def __init__(self, host, username, password, port=8728, connect_timeout=10,
+                 command_timeout=10, max_in_flight=32, backoff_base=0.5, backoff_max=30,
+                 encoding='latin-1', name=None):
+        self.name = name or host  # rótulo do roteador nas métricas
+        self.host = host
+        self.username = username
+        self.password = password
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.command_timeout = command_timeout
+        self.max_in_flight = max_in_flight
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.encoding = encoding
+
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = {}
+        self._tags = itertools.count()
+        self._connect_lock = None
+        self._slots = None
+        self._consecutive_failures = 0
+        self._next_attempt = 0.0
+        self._stats = {
+            'connections_created': 0,
+            'connect_failures': 0,
+            'disconnects': 0,
+            'commands': 0,
+            'command_timeouts': 0,
+            'traps': 0,
+        }
+
+    # Primitivas criadas dentro do loop em execução (o cliente pode ser instanciado antes)
+    def _ensure_primitives(self):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    def _encode_sentence(self, *words):
+        encoded = b''
+        for word in words:
+            data = word.encode(self.encoding, 'strict')
+            encoded += Encoder.encodeLength(len(data)) + data
+        return encoded + b'\x00'
+
+    async def _read_word(self, reader):
+        first = await reader.readexactly(1)
+        extra = Decoder.determineLength(first)
+        length = Decoder.decodeLength(first + (await reader.readexactly(extra) if extra else b''))
+        if not length:
+            return ''
+        return (await reader.readexactly(length)).decode(self.encoding, 'strict')
+
+    async def _read_sentence(self, reader):
+        words = []
+        while True:
+            word = await self._read_word(reader)
+            if not word:
+                break
+            words.append(word)
+        return words[0], words[1:]
+
+    async def _open(self):
+        wait = self._next_attempt - time.monotonic()
+        if wait > 0:
+            raise ConnectionError(f"Reconexão ao MikroTik em backoff por mais {wait:.1f} segundos")
+        started = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.connect_timeout)
+            try:
+                # Login (RouterOS >= 6.43) antes de iniciar a leitura multiplexada
+                writer.write(self._encode_sentence(
+                    '/login', compose_word('name', self.username),
+                    compose_word('password', self.password)))
+                await writer.drain()
+                while True:
+                    reply_word, words = await asyncio.wait_for(
+                        self._read_sentence(reader), self.connect_timeout)
+                    if reply_word in ('!trap', '!fatal'):
+                        _, attributes = parse_words(words)
+                        raise ConnectionError(
+                            f"Falha no login do MikroTik: {attributes.get('message', words)}")
+                    if reply_word == '!done':
+                        break
+            except BaseException:
+                writer.close()
+                raise
+        except Exception:
+            ERRORS.inc(kind='routeros_connect')
+            self._consecutive_failures += 1
+            self._stats['connect_failures'] += 1
+            delay = min(self.backoff_max,
+                        self.backoff_base * (2 ** (self._consecutive_failures - 1)))
+            self._next_attempt = time.monotonic() + delay
+            raise
+
+        ROUTEROS_CONNECT_SECONDS.observe(time.perf_counter() - started, router=self.name)
+        self._consecutive_failures = 0
+        self._next_attempt = 0.0
+        self._stats['connections_created'] += 1
+        self._reader, self._writer = reader, writer
+        self._reader_task = asyncio.ensure_future(self._read_loop(reader))
+
+    async def _ensure_connected(self):
+        self._ensure_primitives()
+        if self.connected:
+            return
+        async with self._connect_lock:
+            if not self.connected:
+                await self._open()
+
+    async def _read_loop(self, reader):
+        error = None
+        try:
+            while True:
+                reply_word, words = await self._read_sentence(reader)
+                if reply_word == '!fatal':
+                    raise FatalError(words[0] if words else '')
+                tag, attributes = parse_words(words)
+                pending = self._pending.get(tag)
+                if pending is None:
+                    continue  # comando já expirado ou cancelado
+                if reply_word == '!trap':
+                    pending.traps.append(TrapError(**attributes))
+                elif reply_word == '!re' and pending.on_row is not None:
+                    pending.on_row(attributes)
+                elif reply_word in ('!re', '!done') and attributes:
+                    pending.rows.append(attributes)
+                if reply_word == '!done':
+                    del self._pending[tag]
+                    if not pending.future.done():
+                        pending.future.set_result(pending)
+        except asyncio.CancelledError:
+            error = ConnectionClosed('Conexão com o MikroTik encerrada.')
+        except asyncio.IncompleteReadError:
+            error = ConnectionClosed('Conexão com o MikroTik encerrada inesperadamente.')
+        except Exception as e:
+            error = e
+        if reader is self._reader:  # a sessão pode já ter sido derrubada por disconnect()
+            self._drop_connection(error)
+
+    # Descarta a sessão atual e falha todos os comandos que esperavam resposta
+    def _drop_connection(self, error):
+        if self._writer is not None:
+            self._writer.close()
+            self._stats['disconnects'] += 1
+            ERRORS.inc(kind='routeros_disconnect')
+        self._reader = self._writer = None
+        pending, self._pending = self._pending, {}
+        for command in pending.values():
+            if not command.future.done():
+                command.future.set_exception(error)
+
+    # Executa um comando com palavras já formatadas (=chave=valor, ?filtro=valor)
+    # e retorna a lista de linhas da resposta. Lança TrapError como a librouteros.
+    async def raw(self, cmd, *words, timeout=None):
+        timeout = self.command_timeout if timeout is None else timeout
+        await self._ensure_connected()
+        async with self._slots:
+            if not self.connected:
+                await self._ensure_connected()
+            tag = str(next(self._tags))
+            command = _PendingCommand(asyncio.get_running_loop().create_future())
+            self._pending[tag] = command
+            self._stats['commands'] += 1
+            started = time.perf_counter()
+            try:
+                self._writer.write(self._encode_sentence(cmd, *words, f'.tag={tag}'))
+                await self._writer.drain()
+                await asyncio.wait_for(asyncio.shield(command.future), timeout)
+            except asyncio.TimeoutError:
+                self._stats['command_timeouts'] += 1
+                ERRORS.inc(kind='routeros_timeout')
+                raise
+            finally:
+                self._pending.pop(tag, None)
+                observe_command(self.name, cmd, time.perf_counter() - started)
+
+        if command.traps:
+            self._stats['traps'] += 1
+            ERRORS.inc(kind='routeros_trap')
+            if len(command.traps) > 1:
+                raise MultiTrapError(*command.traps)
+            raise command.traps[0]
+        return command.rows
+
+    # Inicia um comando de resposta contínua (ex: .../listen): cada !re é entregue a
+    # on_row(linha) assim que chega. Retorna depois de enviar a sentença; o comando
+    # não ocupa vaga de max_in_flight nem tem timeout e vai até o !done, a queda da
+    # sessão ou _Stream.cancel().
+    async def stream(self, cmd, *words, on_row):
+        await self._ensure_connected()
+        tag = str(next(self._tags))
+        command = _PendingCommand(asyncio.get_running_loop().create_future(), on_row)
+        self._pending[tag] = command
+        self._writer.write(self._encode_sentence(cmd, *words, f'.tag={tag}'))
+        await self._writer.drain()
+        return _Stream(self, tag, command)
+
+    # Derruba a sessão atual (ex: roteador sem responder); a próxima chamada reconecta
+    def disconnect(self, reason):
+        if self._reader_task is not None and self.connected:
+            self._reader_task.cancel()
+            self._reader_task = None
+            self._drop_connection(ConnectionClosed(reason))
+
+    async def __call__(self, cmd, timeout=None, **attributes):
+        words = (compose_word(key, value) for key, value in attributes.items())
+        return await self.raw(cmd, *words, timeout=timeout)
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except BaseException:
+                pass
+            self._reader_task = None
+        self._drop_connection(ConnectionClosed('Cliente do MikroTik encerrado.'))
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats.update({
+            'host': self.host,
+            'connected': self.connected,
+            'in_flight': len(self._pending),
+            'max_in_flight': self.max_in_flight,
+            'consecutive_failures': self._consecutive_failures,
+            'backoff_remaining': max(0.0, self._next_attempt - time.monotonic()),
+        })
+        return stats
@@ -0,0 +1,69 @@
+from librouteros.protocol import compose_word, parse_word
+import time
+
+
+# Monta uma sentença (comando + palavras de atributo) para pipeline()
+def command(cmd, **attributes):
+    return (cmd,) + tuple(compose_word(key, value) for key, value in attributes.items())
+
+
+# Monta uma sentença de print filtrado (?chave=valor) para pipeline()
+def query(cmd, **filters):
+    return (cmd,) + tuple(f'?{key}={value}' for key, value in filters.items())
+
+
+# Separa a palavra .tag das palavras de atributo (=chave=valor) de uma resposta
+def parse_words(words):
+    tag = None
+    attributes = {}
+    for word in words:
+        if word.startswith('.tag='):
+            tag = word[len('.tag='):]
+        elif word.startswith('='):
+            key, value = parse_word(word)
+            attributes[key] = value
+    return tag, attributes
+
+
+# Envia várias sentenças na mesma sessão sem esperar a resposta de cada uma,
+# identificando as respostas pela palavra .tag. O envio é feito em janelas de
+# `window` sentenças para não encher os buffers do socket dos dois lados.
+# Retorna, na ordem das sentenças, (True, linhas) ou (False, mensagem de erro).
+# Se a sessão tem `observe(cmd, segundos, erro)` (mikrotik_pool.TimedApi), informa o
+# tempo de cada sentença, do envio da janela até o seu !done.
+def pipeline(api, sentences, window=50):
+    sentences = list(sentences)
+    results = [None] * len(sentences)
+    observe = getattr(api, 'observe', None)
+
+    for start in range(0, len(sentences), window):
+        chunk = range(start, min(start + window, len(sentences)))
+        rows = {str(i): [] for i in chunk}
+        traps = {}
+        sent_at = time.perf_counter()
+        for i in chunk:
+            cmd, *words = sentences[i]
+            api.protocol.writeSentence(cmd, *words, f'.tag={i}')
+
+        pending = set(rows)
+        while pending:
+            reply_word, words = api.protocol.readSentence()
+            tag, attributes = parse_words(words)
+            if tag not in rows:
+                continue
+            if reply_word == '!trap':
+                traps.setdefault(tag, []).append(attributes.get('message', 'erro desconhecido'))
+            elif reply_word in ('!re', '!done') and attributes:
+                rows[tag].append(attributes)
+            if reply_word == '!done':
+                pending.discard(tag)
+                if observe:
+                    observe(sentences[int(tag)][0], time.perf_counter() - sent_at, tag in traps)
+
+        for i in chunk:
+            tag = str(i)
+            if tag in traps:
+                results[i] = (False, ', '.join(traps[tag]))
+            else:
+                results[i] = (True, rows[tag])
+    return results
@@ -0,0 +1,156 @@
+from librouteros.protocol import cast_to_api
+from routeros_pipeline import pipeline, command
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+
+# Reconciliador de estado desejado para o RouterOS.
+#
+# O estado desejado é uma lista de tabelas, aplicadas na ordem em que aparecem:
+#   {
+#       'path': '/interface/vlan',       # menu da API
+#       'key': 'name',                   # atributo(s) que identificam a entrada
+#       'entries': [{...}, ...],         # entradas que devem existir, com os atributos gerenciados
+#       'absent': [{'name': '...'}],     # (opcional) entradas que devem deixar de existir
+#       'prune': False,                  # (opcional) remove tudo o que não está em 'entries'
+#       'ordered': False,                # (opcional) mantém a ordem de 'entries' (ex: firewall)
+#   }
+# Cada tabela é lida uma única vez (prints em pipeline), o diff gera mudanças
+# add/update/remove e só essas mudanças são aplicadas, na mesma sessão.
+
+Change = namedtuple('Change', 'action path key attributes id')
+
+
+def _key_fields(table):
+    key = table['key']
+    return (key,) if isinstance(key, str) else tuple(key)
+
+
+def _key_of(fields, entry):
+    return tuple(cast_to_api(entry.get(field, '')) for field in fields)
+
+
+def _differences(desired, current):
+    return {attr: value for attr, value in desired.items()
+            if cast_to_api(current.get(attr, '')) != cast_to_api(value)}
+
+
+# Lê todas as tabelas do estado desejado com um único lote de prints em pipeline
+def fetch_state(api, spec):
+    replies = pipeline(api, [command(f"{table['path']}/print") for table in spec])
+    current = {}
+    for table, (ok, rows) in zip(spec, replies):
+        if not ok:
+            raise RuntimeError(f"Erro ao ler {table['path']}: {rows}")
+        current[table['path']] = rows
+    return current
+
+
+# Compara o estado desejado com o atual e devolve a lista de mudanças
+def plan(spec, current):
+    changes = []
+    for table in spec:
+        path = table['path']
+        fields = _key_fields(table)
+        rows = current.get(path, [])
+        by_key = {}
+        for row in rows:
+            by_key.setdefault(_key_of(fields, row), row)
+
+        wanted = set()
+        for entry in table['entries']:
+            key = _key_of(fields, entry)
+            wanted.add(key)
+            row = by_key.get(key)
+            if row is None:
+                changes.append(Change('add', path, key, dict(entry), None))
+                continue
+            diff = _differences(entry, row)
+            if diff:
+                changes.append(Change('update', path, key, diff, row['.id']))
+
+        absent = {_key_of(fields, entry) for entry in table.get('absent', [])}
+        for row in rows:
+            key = _key_of(fields, row)
+            if key in absent or (table.get('prune') and key not in wanted):
+                if not row.get('dynamic') and not row.get('default'):
+                    changes.append(Change('remove', path, key, {}, row['.id']))
+    return changes
+
+
+# Em tabelas ordenadas, uma entrada nova entra antes da próxima entrada gerenciada
+# que já existe no roteador, para não cair depois de uma regra de bloqueio.
+def _place_before(table, entry, current_ids):
+    fields = _key_fields(table)
+    keys = [_key_of(fields, item) for item in table['entries']]
+    position = keys.index(_key_of(fields, entry))
+    for key in keys[position + 1:]:
+        if key in current_ids:
+            return current_ids[key]
+    return None
+
+
+# Aplica as mudanças na sessão informada, na ordem do plano
+def apply(api, spec, changes, current):
+    tables = {table['path']: table for table in spec}
+    ids = {path: {_key_of(_key_fields(tables[path]), row): row['.id'] for row in rows}
+           for path, rows in current.items()}
+
+    for change in changes:
+        try:
+            _apply_change(api, tables[change.path], change, ids)
+        except Exception as e:
+            raise RuntimeError(f"Erro ao aplicar {format_change(change)}: {e}") from e
+
+
+def _apply_change(api, table, change, ids):
+    if change.action == 'add':
+        attributes = dict(change.attributes)
+        if table.get('ordered'):
+            before = _place_before(table, attributes, ids[change.path])
+            if before:
+                attributes['place-before'] = before
+        result = tuple(api(f'{change.path}/add', **attributes))
+        if result and 'ret' in result[0]:
+            ids[change.path][change.key] = result[0]['ret']
+    elif change.action == 'update':
+        tuple(api(f'{change.path}/set', **{'.id': change.id}, **change.attributes))
+    elif change.action == 'remove':
+        tuple(api(f'{change.path}/remove', **{'.id': change.id}))
+        ids[change.path].pop(change.key, None)
+
+
+# Lê, compara e (fora do modo plano) aplica. Retorna a lista de mudanças.
+def reconcile(api, spec, dry_run=False):
+    current = fetch_state(api, spec)
+    changes = plan(spec, current)
+    if not dry_run:
+        apply(api, spec, changes, current)
+    return changes
+
+
+# Reconcilia vários roteadores em paralelo; `connect(host)` abre a sessão de cada um.
+# Retorna {host: (mudanças, erro)}.
+def reconcile_many(connect, hosts, spec, dry_run=False, max_workers=8):
+    def run(host):
+        try:
+            api = connect(host)
+        except Exception as e:
+            return [], f"Erro ao conectar: {e}"
+        try:
+            return reconcile(api, spec, dry_run), None
+        except Exception as e:
+            return [], str(e)
+        finally:
+            api.close()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(hosts)))) as executor:
+        return dict(zip(hosts, executor.map(run, hosts)))
+
+
+def format_change(change):
+    key = '/'.join(change.key)
+    if change.action == 'add':
+        return f"+ {change.path} {key} {change.attributes}"
+    if change.action == 'update':
+        return f"~ {change.path} {key} {change.attributes}"
+    return f"- {change.path} {key}"
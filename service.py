@@ -0,0 +1,178 @@
+from binding_cache import iter_bindings, page_bindings
+from mac_leases import lease_expiry
+from metrics import ERRORS, LEASES
+from payloads import parse_payment_notification
+from router_expiry import binding_comment, comment_expiry, service_comment
+from webhook_queue import PAYMENT_ACTIONS, verify_signature
+import json, logging, time
+
+log = logging.getLogger(__name__)
+
+# Regras do serviço comuns ao servidor Flask (liberaçãomikrotik.py) e ao servidor
+# assíncrono (servidor_async.py), sem I/O com o roteador nem com o framework: cada
+# servidor lê a requisição, fala com o MikroTik do seu jeito e monta a resposta com
+# os corpos e códigos de status daqui, como payloads.py faz com a validação.
+
+
+def error_body(message):
+    return {"success": False, "message": message}
+
+
+# Campo opcional 'site' das requisições, usado para escolher o roteador
+def request_site(data):
+    return data.get('site') if isinstance(data, dict) else None
+
+
+# Prazo e comentário de uma liberação de `duration` segundos; o prazo vigente (no
+# agendador) só conta se o MAC ainda está no IP Binding. O comentário só leva a
+# expiração (lida pela varredura do roteador) com expiry_mode='router'. Chamado com
+# o lock do MAC.
+def lease_terms(scheduler, mac_address, duration, bound, mode, expiry_mode):
+    now = time.time()
+    current = scheduler.expires_at(mac_address) if bound else None
+    expires_at = lease_expiry(current, duration, mode, now)
+    tagged = expires_at if expiry_mode == 'router' else None
+    return expires_at, binding_comment(int(round(expires_at - now)), tagged)
+
+
+# O serviço só renova bindings que ele mesmo criou: com expiração local neste
+# roteador ou, sem ela, com o comentário do serviço (`rows`, o print filtrado do
+# MAC), que não depende do modo de expiração: um binding criado pouco antes de uma
+# queda, ainda sem expiração local, é retomado e ganha prazo na renovação. Os demais
+# (bloqueios, liberações permanentes do administrador) ficam como estão e a
+# liberação é recusada com binding_taken.
+def leased_here(scheduler, gateway, mac_address):
+    return scheduler.expires_at(mac_address) is not None and scheduler.router_of(mac_address) == gateway.name
+
+
+def service_binding(rows):
+    return any(service_comment(row.get('comment')) for row in rows)
+
+
+def binding_taken(mac_address):
+    return False, f"MAC {mac_address} já está no IP Binding."
+
+
+# Prazo vigente do MAC, a partir do print filtrado (`rows`): None se ele não está no
+# IP Binding; senão o maior entre a expiração local e a gravada no comentário
+def current_lease(scheduler, mac_address, rows):
+    if not rows:
+        return None
+    expiries = [scheduler.expires_at(mac_address)] + [comment_expiry(row.get('comment')) for row in rows]
+    expiries = [expires_at for expires_at in expiries if expires_at is not None]
+    return max(expiries) if expiries else None
+
+
+def lease_message(mac_address, renewed, expires_at):
+    if renewed:
+        return f"Acesso do MAC {mac_address} renovado; expira em {int(round(expires_at - time.time()))} segundos."
+    return f"MAC {mac_address} adicionado com sucesso à VLAN Irrestrita."
+
+
+# Depois da escrita no roteador: agenda a remoção do MAC no novo prazo, no roteador
+# onde ele foi liberado, e conta a liberação. Chamado com o lock do MAC; retorna
+# (True, mensagem).
+def record_lease(scheduler, gateway, mac_address, duration, expires_at, renewed):
+    scheduler.schedule(mac_address, expires_at, gateway.name)
+    LEASES.inc(outcome='renewed' if renewed else 'added')
+    log.info("Acesso do MAC renovado" if renewed else "MAC movido para VLAN Irrestrita",
+             extra={'router': gateway.name, 'mac': mac_address, 'duration': duration, 'expires_at': int(expires_at)})
+    return True, lease_message(mac_address, renewed, expires_at)
+
+
+# Roteador sobrecarregado: a operação não chegou ao MikroTik. 429 com a fila cheia,
+# 503 com o prazo esgotado na fila; Retry-After estima quando haverá vaga.
+# Retorna (corpo, status, cabeçalhos).
+def admission_rejection(error):
+    return error_body(str(error)), error.status, {'Retry-After': str(error.retry_after)}
+
+
+NOTIFICATION_OK = {"success": True, "message": "Notificação processada com sucesso"}
+NOTIFICATION_FAILED = error_body("Erro ao processar notificação")
+
+
+# Valida uma notificação do Mercado Pago (conteúdo, campos e, quando o segredo está
+# configurado, a assinatura). Retorna ((payment_id, action) a registrar na fila, ou
+# None se a notificação não é tratada, e (corpo, status) de erro, ou None).
+def check_payment_notification(content_type, data, headers, args, secret):
+    if content_type != 'application/json':
+        return None, (error_body("Conteúdo inválido"), 400)
+    log.debug("Notificação recebida do Mercado Pago", extra={'body': data})
+
+    # Extração e validação das informações da notificação
+    action, notification_type, payment_id, error = parse_payment_notification(data)
+    if error:
+        log.warning("Notificação inválida: %s", error, extra={'action': action, 'type': notification_type, 'payment_id': payment_id})
+        return None, (error_body(error), 400)
+    log.debug("Notificação validada", extra={'action': action, 'type': notification_type, 'payment_id': payment_id})
+
+    if secret and not verify_signature(secret, headers.get('x-signature'), headers.get('x-request-id'),
+                                       args.get('data.id', payment_id)):
+        log.warning("Assinatura inválida na notificação", extra={'payment_id': payment_id})
+        ERRORS.inc(kind='webhook_signature')
+        return None, (error_body("Assinatura inválida"), 401)
+
+    if notification_type == "payment" and action in PAYMENT_ACTIONS:
+        return (payment_id, action), None
+    log.info("Notificação não tratada", extra={'type': notification_type, 'action': action})
+    return None, None
+
+
+def log_payment_recorded(payment_id, action, queued):
+    if queued:
+        log.info("Pagamento enfileirado para liberação", extra={'payment_id': payment_id, 'action': action})
+    else:
+        log.info("Notificação repetida ignorada", extra={'payment_id': payment_id, 'action': action})
+
+
+# Gateways consultados por GET /bindings (todos ou o de ?router=). Retorna
+# (gateways, (corpo, status) de erro ou None).
+def bindings_gateways(registry, query, enabled):
+    if not enabled:
+        return None, (error_body("Cópia do IP Binding desativada (BINDING_CACHE=0)."), 503)
+    if query['router']:
+        if query['router'] not in registry.gateways:
+            return None, (error_body(f"Roteador desconhecido: {query['router']}"), 400)
+        gateways = [registry.get(query['router'])]
+    else:
+        gateways = list(registry)
+    if not any(gateway.bindings.synced for gateway in gateways):
+        return None, (error_body("Cópia do IP Binding ainda não sincronizada."), 503)
+    return gateways, None
+
+
+# Linhas NDJSON de todas as entradas filtradas, geradas uma a uma
+def bindings_ndjson(gateways, query):
+    for row in iter_bindings(gateways, query['mac'], query['comment']):
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+def bindings_page(gateways, query):
+    total, page = page_bindings(gateways, query['mac'], query['comment'], query['offset'], query['limit'])
+    return {"total": total, "offset": query['offset'], "limit": query['limit'],
+            "synced": {gateway.name: gateway.bindings.synced for gateway in gateways}, "bindings": page}
+
+
+# Expirações pendentes (MAC, instante de expiração e roteador), da mais próxima à mais distante
+def expiries_body(scheduler, mode):
+    entries = [{"mac_address": mac, "expires_at": expires_at, "router": router}
+               for mac, expires_at, router in scheduler.entries()]
+    return {"mode": mode, "pending": len(entries), "entries": entries}
+
+
+# Saúde de cada roteador e status da resposta: 503 quando algum roteador está com falha
+def routers_health(registry):
+    health = registry.health()
+    return health, 200 if all(item['healthy'] for item in health.values()) else 503
+
+
+# Na inicialização, com o índice do roteador já carregado (`error` se a carga
+# falhou), descarta as expirações de MACs que já não estão no IP Binding
+def reconcile_gateway_expiries(scheduler, gateway, mac_addresses, error=None):
+    if error:
+        log.warning("Erro ao reconciliar expirações com o MikroTik, mantendo todas", extra={'router': gateway.name, 'error': str(error)})
+        return
+    for mac_address in mac_addresses:
+        if not gateway.index.get(mac_address):
+            scheduler.cancel(mac_address)
+            log.info("Expiração descartada: MAC não está mais no IP Binding", extra={'router': gateway.name, 'mac': mac_address})
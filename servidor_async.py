@@ -0,0 +1,593 @@
+from quart import Quart, Response, request, jsonify, g
+from routeros_async import AsyncRouterOS
+from binding_index import BINDING_PATH
+from router_registry import RouterRegistry
+from router_expiry import install_sweep
+from binding_cache import follow_bindings
+from mac_leases import AsyncMacLocks, AsyncSingleFlight
+from admission import AsyncAdmissionQueue, AdmissionError, REMOVE, ADD, READ
+from expiry_scheduler import ExpiryStore, ExpiryScheduler
+from webhook_queue import PaymentEventStore, PaymentWorker, fetch_mercadopago_payment
+from payloads import (
+    parse_add, parse_remove, parse_batch_add, parse_batch_remove, batch_body, parse_bindings_query,
+)
+from settings import (
+    ROUTER_CONFIGS, ROUTER_MACS, ROUTER_SITES, ROUTER_ENCODING, ADMISSION_QUEUE_SIZE, ADMISSION_MAX_WAIT,
+    EXPIRY_DB_PATH, EXPIRY_BATCH_WINDOW, EXPIRY_RETRY_DELAY, EXPIRY_MODE, EXPIRY_SWEEP_INTERVAL, LEASE_MODE,
+    BINDING_CACHE, BINDING_HEARTBEAT, BATCH_MAX_ENTRIES,
+    MP_ACCESS_TOKEN, MP_WEBHOOK_SECRET, PAYMENT_DB_PATH, PAYMENT_MAX_ATTEMPTS,
+)
+from service import (
+    request_site, lease_terms, leased_here, service_binding, binding_taken, current_lease, record_lease,
+    admission_rejection,
+    NOTIFICATION_OK, NOTIFICATION_FAILED, check_payment_notification, log_payment_recorded,
+    bindings_gateways, bindings_ndjson, bindings_page, expiries_body, routers_health,
+    reconcile_gateway_expiries,
+)
+from metrics import REGISTRY, CONTENT_TYPE, EXPIRIES_PENDING, ERRORS, LEASES, observe_http
+from logs import setup_logging
+from librouteros import connect
+from librouteros.exceptions import TrapError
+import asyncio, time, logging
+import os
+
+# Modo de produção: aplicação ASGI servida pelo uvicorn
+#   uvicorn servidor_async:app --host 0.0.0.0 --port 5000
+# Mesmos endpoints e contratos de liberaçãomikrotik.py, mas as chamadas ao
+# MikroTik usam um cliente asyncio por roteador, que multiplexa os comandos em uma
+# única sessão; um roteador lento não prende workers nem atrasa os demais roteadores
+# e cada requisição tem tempo limite.
+app = Quart(__name__)
+
+# Logs estruturados com nível (LOG_LEVEL), escritos fora do loop por uma thread própria
+setup_logging()
+log = logging.getLogger(__name__)
+
+# Configurações comuns aos dois servidores em settings.py (roteadores, expirações,
+# cópia do IP Binding, Mercado Pago); aqui só as do cliente assíncrono.
+
+# Tempos limite e concorrência do cliente assíncrono
+REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', 15))             # Tempo máximo por requisição HTTP
+ROUTER_COMMAND_TIMEOUT = float(os.getenv('ROUTER_COMMAND_TIMEOUT', 10))  # Tempo máximo por comando na API
+ROUTER_MAX_IN_FLIGHT = int(os.getenv('ROUTER_MAX_IN_FLIGHT', 32))     # Comandos simultâneos na sessão
+
+# Operações simultâneas por roteador na fila de admissão (ver admission.py)
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', ROUTER_MAX_IN_FLIGHT))
+
+
+TIMEOUT_MESSAGE = "Tempo limite excedido ao comunicar com o MikroTik."
+
+def _router_client(config):
+    return AsyncRouterOS(
+        host=config['host'], username=config['username'], password=config['password'],
+        port=config['port'], command_timeout=ROUTER_COMMAND_TIMEOUT,
+        max_in_flight=ROUTER_MAX_IN_FLIGHT, encoding=ROUTER_ENCODING, name=config['name'],
+    )
+
+
+def _router_admission(config):
+    return AsyncAdmissionQueue(config['name'], max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+                               max_queue=ADMISSION_QUEUE_SIZE, max_wait=ADMISSION_MAX_WAIT)
+
+
+# Registro dos roteadores; cada um tem seu cliente assíncrono, sua fila de admissão
+# e seu índice local MAC -> .id do IP Binding
+registry = RouterRegistry(ROUTER_CONFIGS, _router_client, ROUTER_MACS, ROUTER_SITES,
+                          admission=_router_admission)
+
+# Loop do servidor, usado pelo agendador de expirações (que roda em outra thread),
+# e locks da carga inicial do índice de cada roteador; criados em startup(), dentro do loop
+_loop = None
+_index_locks = {}
+_followers = []
+_listen_clients = []
+
+
+# Carrega o índice do roteador uma única vez, mesmo com várias requisições chegando juntas.
+# Roda dentro da vaga de admissão de quem chama.
+async def ensure_index(gateway):
+    if gateway.index.loaded:
+        return
+    async with _index_locks[gateway.name]:
+        if not gateway.index.loaded:
+            gateway.index.load_rows(await gateway.client(f'{BINDING_PATH}/print'))
+
+
+# Retorna o .id do binding do MAC (índice local ou print filtrado no roteador)
+async def lookup(gateway, mac_address):
+    await ensure_index(gateway)
+    binding_id = gateway.index.cached(mac_address)
+    if binding_id:
+        return binding_id
+    rows = await gateway.client.raw(f'{BINDING_PATH}/print', f'?mac-address={mac_address}')
+    return gateway.index.remember(mac_address, rows)
+
+
+# Cada MAC é alterado por uma operação de cada vez (liberação, renovação, remoção ou
+# expiração) e liberações idênticas simultâneas (retentativas) viram uma só escrita
+mac_locks = AsyncMacLocks()
+add_flights = AsyncSingleFlight(on_coalesced=lambda: LEASES.inc(outcome='coalesced'))
+
+
+# Prazo e comentário de uma liberação (ver service.lease_terms). Chamado com o lock do
+# MAC, antes da escrita no roteador; `on_lease(prazo)` recebe o prazo calculado.
+def _lease(mac_address, duration, bound, on_lease=None):
+    expires_at, comment = lease_terms(expiry_scheduler, mac_address, duration, bound, LEASE_MODE, EXPIRY_MODE)
+    if on_lease:
+        on_lease(expires_at)
+    return expires_at, comment
+
+
+# Só o comentário: o tipo do binding nunca é reescrito
+async def _set_lease(gateway, binding_id, comment):
+    await gateway.client(f'{BINDING_PATH}/set', **{'.id': binding_id, 'comment': comment})
+
+
+# Binding atual do MAC e se ele foi criado pelo serviço (ver service.leased_here).
+# Sem expiração local, o print filtrado também corrige o índice: sem linhas, o .id
+# era de uma entrada removida por fora e o MAC é liberado com um novo binding.
+# Retorna (.id ou None, do serviço).
+async def _current_binding(gateway, mac_address):
+    binding_id = await lookup(gateway, mac_address)
+    if not binding_id or leased_here(expiry_scheduler, gateway, mac_address):
+        return binding_id, True
+    rows = await gateway.client.raw(f'{BINDING_PATH}/print', f'?mac-address={mac_address}')
+    return gateway.index.remember(mac_address, rows), not rows or service_binding(rows)
+
+
+# Libera ou renova o MAC no roteador. Um MAC já liberado pelo serviço tem o
+# comentário (com o novo prazo) atualizado por /set, sem novo binding; um binding
+# criado por fora recusa a liberação.
+async def _grant(gateway, mac_address, duration, on_lease=None):
+    async with mac_locks.hold(mac_address), gateway.admission.slot(ADD):
+        binding_id, owned = await _current_binding(gateway, mac_address)
+        if not owned:
+            return binding_taken(mac_address)
+        expires_at, comment = _lease(mac_address, duration, bool(binding_id), on_lease)
+        if binding_id:
+            try:
+                await _set_lease(gateway, binding_id, comment)
+            except TrapError:
+                # .id desatualizado (entrada removida ou recriada por fora): consulta o roteador
+                gateway.index.discard(mac_address)
+                binding_id, owned = await _current_binding(gateway, mac_address)
+                if not owned:
+                    return binding_taken(mac_address)
+                if binding_id:
+                    await _set_lease(gateway, binding_id, comment)
+                else:
+                    expires_at, comment = _lease(mac_address, duration, False, on_lease)
+        renewed = bool(binding_id)
+        if not renewed:
+            result = await gateway.client(f'{BINDING_PATH}/add', **{
+                'mac-address': mac_address,
+                'type': 'bypassed',
+                'comment': comment
+            })
+            if result and 'ret' in result[0]:
+                gateway.index.set(mac_address, result[0]['ret'])
+
+        return record_lease(expiry_scheduler, gateway, mac_address, duration, expires_at, renewed)
+
+
+# Adicionar MAC ao IP Binding do roteador informado (ou do roteador do MAC), ou
+# renovar o prazo se ele já estiver liberado
+async def add_mac_to_ip_binding(mac_address, duration, gateway=None):
+    try:
+        gateway = gateway or registry.route(mac_address)
+        return await add_flights.do((mac_address, duration), lambda: _grant(gateway, mac_address, duration))
+    except AdmissionError:
+        raise
+    except asyncio.TimeoutError:
+        return False, f"Erro ao adicionar MAC ao IP Binding: {TIMEOUT_MESSAGE}"
+    except Exception as e:
+        return False, f"Erro ao adicionar MAC ao IP Binding: {e}"
+
+
+async def _delete_binding(gateway, mac_address):
+    binding_id = await lookup(gateway, mac_address)
+    if not binding_id:
+        return f"MAC {mac_address} não está no IP Binding."
+    try:
+        await gateway.client(f'{BINDING_PATH}/remove', **{'.id': binding_id})
+    except TrapError:
+        # .id desatualizado (entrada removida por fora): consulta o roteador e tenta de novo
+        gateway.index.discard(mac_address)
+        binding_id = await lookup(gateway, mac_address)
+        if not binding_id:
+            return f"MAC {mac_address} não está no IP Binding."
+        await gateway.client(f'{BINDING_PATH}/remove', **{'.id': binding_id})
+    gateway.index.discard(mac_address)
+    log.info("MAC removido do IP Binding", extra={'router': gateway.name, 'mac': mac_address})
+    return f"MAC {mac_address} removido com sucesso."
+
+
+# Remove o binding do MAC no roteador onde ele foi liberado, com o lock do MAC.
+# Retorna (sucesso, mensagem); MAC ausente conta como sucesso. Nas expirações
+# (only_due), um MAC renovado depois que a expiração foi entregue fica no IP Binding
+# e conta como tratado; nas remoções pedidas pelo cliente, a expiração é cancelada.
+async def _remove_binding(mac_address, gateway=None, only_due=False):
+    try:
+        gateway = gateway or registry.locate(mac_address, expiry_scheduler.router_of)
+        async with mac_locks.hold(mac_address):
+            if only_due and not expiry_scheduler.is_due(mac_address):
+                return True, f"MAC {mac_address} renovado; expiração adiada."
+            async with gateway.admission.slot(REMOVE):
+                message = await _delete_binding(gateway, mac_address)
+            if not only_due:
+                expiry_scheduler.cancel(mac_address)
+        return True, message
+    except AdmissionError:
+        raise
+    except asyncio.TimeoutError:
+        return False, f"Erro ao remover MAC do IP Binding: {TIMEOUT_MESSAGE}"
+    except Exception as e:
+        return False, f"Erro ao remover MAC do IP Binding: {e}"
+
+
+# Nos lotes, um MAC recusado pela fila de admissão recebe o erro sem derrubar os demais
+async def _admitted(operation, error_message):
+    try:
+        return await operation
+    except AdmissionError as e:
+        return False, f"{error_message}: {e}"
+
+
+# Adicionar vários MACs: os comandos seguem concorrentes, em pipeline na sessão de
+# cada roteador
+async def add_macs_to_ip_binding(entries, site=None):
+    gateways = [registry.route(mac, site) for mac, _ in entries]
+    outcomes = await asyncio.gather(*(_admitted(add_mac_to_ip_binding(mac, duration, gateway),
+                                                "Erro ao adicionar MAC ao IP Binding")
+                                      for (mac, duration), gateway in zip(entries, gateways)))
+    return {mac: outcome for (mac, _), outcome in zip(entries, outcomes)}
+
+
+# Remover vários MACs: os comandos seguem concorrentes, em pipeline na sessão de
+# cada roteador
+async def remove_macs_from_ip_binding(mac_addresses, site=None, only_due=False):
+    gateways = [registry.locate(mac, expiry_scheduler.router_of, site) for mac in mac_addresses]
+    outcomes = await asyncio.gather(*(_admitted(_remove_binding(mac, gateway, only_due),
+                                                "Erro ao remover MAC do IP Binding")
+                                      for mac, gateway in zip(mac_addresses, gateways)))
+    return dict(zip(mac_addresses, outcomes))
+
+
+# Callback do agendador de expirações (thread própria): executa a remoção no loop
+# do servidor e devolve os MACs que não estão mais no IP Binding.
+def _expire_macs(mac_addresses):
+    future = asyncio.run_coroutine_threadsafe(remove_macs_from_ip_binding(mac_addresses, only_due=True), _loop)
+    results = future.result(REQUEST_TIMEOUT)
+    removed = [mac for mac, (ok, _) in results.items() if ok]
+    log.info("Expirações processadas", extra={'removed': len(removed), 'total': len(mac_addresses)})
+    return removed
+
+
+# No modo 'router' o próprio MikroTik remove os bindings vencidos; o agendador só
+# descarta a cópia local das expirações, que serve para consulta (/expiries), e
+# tira do índice os MACs que não foram renovados
+async def _forget_due(mac_addresses):
+    for mac_address in mac_addresses:
+        async with mac_locks.hold(mac_address):
+            if expiry_scheduler.is_due(mac_address):
+                registry.locate(mac_address, expiry_scheduler.router_of).index.discard(mac_address)
+
+
+def _forget_expired(mac_addresses):
+    asyncio.run_coroutine_threadsafe(_forget_due(mac_addresses), _loop).result(REQUEST_TIMEOUT)
+    log.info("Expirações encerradas (remoção feita pelo roteador)", extra={'count': len(mac_addresses)})
+    return mac_addresses
+
+
+# Agendador único das remoções
+expiry_scheduler = ExpiryScheduler(
+    ExpiryStore(EXPIRY_DB_PATH), _forget_expired if EXPIRY_MODE == 'router' else _expire_macs,
+    batch_window=EXPIRY_BATCH_WINDOW, retry_delay=EXPIRY_RETRY_DELAY,
+)
+EXPIRIES_PENDING.set_function(expiry_scheduler.pending_count)
+
+
+# Fila durável das notificações do Mercado Pago, consumida pelo worker de pagamentos
+payment_store = PaymentEventStore(PAYMENT_DB_PATH)
+
+
+# Registra a notificação (SQLite, fora do loop) e acorda o worker.
+# Retorna False para entregas repetidas.
+async def record_payment_event(payment_id, action):
+    queued = await asyncio.get_running_loop().run_in_executor(
+        None, payment_store.record, payment_id, action)
+    if queued:
+        payment_worker.notify()
+    return queued
+
+
+# Funções chamadas pelo worker (thread própria), executadas no loop do servidor. A
+# liberação de um pagamento fica fora de add_flights, que juntaria duas compras
+# idênticas simultâneas em uma única renovação; `on_lease` grava o prazo alvo.
+def _release_payment(mac_address, duration, on_lease):
+    future = asyncio.run_coroutine_threadsafe(
+        _grant(registry.route(mac_address), mac_address, duration, on_lease), _loop)
+    return future.result(REQUEST_TIMEOUT)
+
+
+async def _query_binding(gateway, mac_address):
+    async with gateway.admission.slot(READ):
+        return await gateway.client.raw(f'{BINDING_PATH}/print', f'?mac-address={mac_address}')
+
+
+# Prazo vigente do MAC no roteador (ver service.current_lease)
+def _current_expiry(mac_address):
+    gateway = registry.locate(mac_address, expiry_scheduler.router_of)
+    future = asyncio.run_coroutine_threadsafe(_query_binding(gateway, mac_address), _loop)
+    rows = future.result(REQUEST_TIMEOUT)
+    gateway.index.remember(mac_address, rows)
+    return current_lease(expiry_scheduler, mac_address, rows)
+
+
+payment_worker = PaymentWorker(
+    payment_store, lambda payment_id: fetch_mercadopago_payment(payment_id, MP_ACCESS_TOKEN),
+    _release_payment, _current_expiry, max_attempts=PAYMENT_MAX_ATTEMPTS,
+)
+
+
+async def _load_index(gateway):
+    async with gateway.admission.slot(READ):
+        await ensure_index(gateway)
+
+
+# Na inicialização, descarta as expirações de MACs que já não estão no roteador
+async def reconcile_expiries():
+    pending = expiry_scheduler.pending()
+    if not pending:
+        return
+    groups = registry.group(pending, expiry_scheduler.router_of)
+    loaded = await asyncio.gather(*(_load_index(gateway) for gateway in groups),
+                                  return_exceptions=True)
+    for (gateway, mac_addresses), error in zip(groups.items(), loaded):
+        reconcile_gateway_expiries(expiry_scheduler, gateway, mac_addresses, error)
+
+
+# Instala a varredura de expirações em um roteador, com uma sessão própria (síncrona,
+# fora do loop) que é fechada em seguida
+def _install_sweep(gateway):
+    config = gateway.config
+    api = connect(username=config['username'], password=config['password'], host=config['host'],
+                  port=config['port'], encoding=ROUTER_ENCODING, timeout=ROUTER_COMMAND_TIMEOUT)
+    try:
+        changes = install_sweep(api, EXPIRY_SWEEP_INTERVAL)
+    finally:
+        api.close()
+    if changes:
+        log.info("Varredura de expirações instalada no roteador", extra={'router': gateway.name})
+
+
+# Instala a varredura em todos os roteadores; um roteador fora do ar não impede a
+# inicialização (a instalação é repetida no próximo início)
+async def install_router_sweeps():
+    loop = asyncio.get_running_loop()
+    gateways = list(registry)
+    results = await asyncio.gather(*(loop.run_in_executor(None, _install_sweep, gateway)
+                                     for gateway in gateways), return_exceptions=True)
+    for gateway, error in zip(gateways, results):
+        if error:
+            log.error("Erro ao instalar a varredura de expirações", extra={'router': gateway.name, 'error': str(error)})
+
+
+@app.before_serving
+async def startup():
+    global _loop
+    _loop = asyncio.get_running_loop()
+    for gateway in registry:
+        _index_locks[gateway.name] = asyncio.Lock()
+        if BINDING_CACHE:
+            # sessão própria para o listen, como no servidor Flask: as mudanças e os
+            # heartbeats não disputam a sessão dos comandos
+            listen_client = _router_client(gateway.config)
+            _listen_clients.append(listen_client)
+            _followers.append(asyncio.ensure_future(follow_bindings(
+                gateway.bindings, listen_client, gateway.index, name=gateway.name,
+                heartbeat=BINDING_HEARTBEAT)))
+    expiry_scheduler.load()
+    if EXPIRY_MODE == 'router':
+        await install_router_sweeps()
+    else:
+        await reconcile_expiries()
+    expiry_scheduler.start()
+    if MP_ACCESS_TOKEN:
+        payment_worker.start()
+    else:
+        log.warning("MP_ACCESS_TOKEN não configurado: notificações ficam na fila até a configuração.")
+
+
+@app.after_serving
+async def shutdown():
+    for follower in _followers:
+        follower.cancel()
+    await asyncio.gather(*_followers, return_exceptions=True)
+    await asyncio.get_running_loop().run_in_executor(None, payment_worker.stop)
+    await asyncio.get_running_loop().run_in_executor(None, expiry_scheduler.stop)
+    await asyncio.gather(*(gateway.client.close() for gateway in registry),
+                         *(client.close() for client in _listen_clients))
+
+
+def _timeout_response():
+    ERRORS.inc(kind='http_timeout')
+    return jsonify({"success": False, "message": TIMEOUT_MESSAGE}), 504
+
+
+# Roteador sobrecarregado: 429/503 com Retry-After (ver service.admission_rejection)
+@app.errorhandler(AdmissionError)
+async def admission_rejected(error):
+    body, status, headers = admission_rejection(error)
+    return jsonify(body), status, headers
+
+
+# Tempo de cada requisição por endpoint
+@app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+async def observe_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        observe_http(request.url_rule.rule if request.url_rule else None, request.method,
+                     response.status_code, time.perf_counter() - started)
+    return response
+
+
+# Endpoint para receber notificações do Mercado Pago
+@app.route('/payment-notification', methods=['POST'])
+async def payment_notification():
+    try:
+        payment, error = check_payment_notification(
+            request.content_type, await request.get_json(silent=True), request.headers, request.args,
+            MP_WEBHOOK_SECRET)
+        if error:
+            return jsonify(error[0]), error[1]
+
+        # Registra a notificação na fila durável; a liberação é feita pelo worker
+        if payment:
+            log_payment_recorded(*payment, await record_payment_event(*payment))
+
+        # Responde ao Mercado Pago imediatamente
+        return jsonify(NOTIFICATION_OK), 200
+
+    except Exception:
+        log.exception("Erro ao processar notificação")
+        return jsonify(NOTIFICATION_FAILED), 500
+
+
+# Endpoint para mover MAC para VLAN Irrestrita
+@app.route('/add_mac', methods=['POST'])
+async def add_mac():
+    data = await request.get_json()
+    log.debug("Requisição recebida", extra={'body': data})
+
+    mac_address, duration, error = parse_add(data)
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+    try:
+        gateway = registry.route(mac_address, request_site(data))
+    except LookupError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    try:
+        success, message = await asyncio.wait_for(
+            add_mac_to_ip_binding(mac_address, duration, gateway), REQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        return _timeout_response()
+    status_code = 200 if success else 500
+    return jsonify({"success": success, "message": message}), status_code
+
+
+# Endpoint para remover MAC do IP Binding
+@app.route('/remove_mac', methods=['POST'])
+async def remove_mac():
+    data = await request.get_json()
+    mac_address, error = parse_remove(data)
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+
+    try:
+        gateway = registry.locate(mac_address, expiry_scheduler.router_of, request_site(data))
+    except LookupError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    try:
+        success, message = await asyncio.wait_for(_remove_binding(mac_address, gateway), REQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        return _timeout_response()
+    if not success:
+        log.error("Erro ao remover MAC do IP Binding", extra={'mac': mac_address, 'error': message})
+    return jsonify({"success": True, "message": f"MAC {mac_address} removido com sucesso."}), 200
+
+
+# Endpoint para mover vários MACs para VLAN Irrestrita de uma vez
+@app.route('/add_macs', methods=['POST'])
+async def add_macs():
+    data = await request.get_json(silent=True)
+    template, valid, error = parse_batch_add(data, BATCH_MAX_ENTRIES)
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+
+    try:
+        outcome = await asyncio.wait_for(
+            add_macs_to_ip_binding(valid, request_site(data)), REQUEST_TIMEOUT) if valid else {}
+    except LookupError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except asyncio.TimeoutError:
+        return _timeout_response()
+    return jsonify(batch_body(template, outcome)), 200
+
+
+# Endpoint para remover vários MACs do IP Binding de uma vez
+@app.route('/remove_macs', methods=['POST'])
+async def remove_macs():
+    data = await request.get_json(silent=True)
+    template, valid, error = parse_batch_remove(data, BATCH_MAX_ENTRIES)
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+
+    try:
+        outcome = await asyncio.wait_for(
+            remove_macs_from_ip_binding(valid, request_site(data)), REQUEST_TIMEOUT) if valid else {}
+    except LookupError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except asyncio.TimeoutError:
+        return _timeout_response()
+    return jsonify(batch_body(template, outcome)), 200
+
+
+# Estado da sessão assíncrona com cada roteador (comandos em andamento, reconexões)
+@app.route('/router_stats', methods=['GET'])
+async def router_stats():
+    return jsonify({gateway.name: gateway.client.stats() for gateway in registry}), 200
+
+
+# Estatísticas do índice de MACs de cada roteador (acertos, consultas ao roteador, tamanho)
+@app.route('/index_stats', methods=['GET'])
+async def index_stats():
+    return jsonify({gateway.name: gateway.index.stats() for gateway in registry}), 200
+
+
+# Entradas do IP Binding servidas da cópia local, sem consultar o roteador. Filtros
+# ?mac= (exato), ?comment= (trecho) e ?router=; paginação com ?offset= e ?limit=.
+# Com ?format=ndjson (ou Accept: application/x-ndjson) envia todas as entradas
+# filtradas, uma por linha, sem montar a resposta inteira na memória.
+@app.route('/bindings', methods=['GET'])
+async def bindings():
+    query, error = parse_bindings_query(request.args, request.headers.get('Accept', ''))
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+    gateways, error = bindings_gateways(registry, query, BINDING_CACHE)
+    if error:
+        return jsonify(error[0]), error[1]
+    if query['ndjson']:
+        async def lines():
+            for line in bindings_ndjson(gateways, query):
+                yield line.encode()
+        return Response(lines(), mimetype='application/x-ndjson')
+    return jsonify(bindings_page(gateways, query)), 200
+
+
+# Expirações pendentes (MAC, instante de expiração e roteador), da mais próxima à mais distante
+@app.route('/expiries', methods=['GET'])
+async def expiries():
+    return jsonify(expiries_body(expiry_scheduler, EXPIRY_MODE)), 200
+
+
+# Saúde de cada roteador (falhas de conexão seguidas, espera de reconexão, sessão, índice
+# e fila de admissão). Responde 503 quando algum roteador está com falha.
+@app.route('/routers', methods=['GET'])
+async def routers():
+    health, status_code = routers_health(registry)
+    return jsonify(health), status_code
+
+
+# Métricas no formato do Prometheus: latência por comando do RouterOS e por endpoint,
+# tempo de conexão e login, expirações pendentes e erros por tipo
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    return REGISTRY.render(), 200, {'Content-Type': CONTENT_TYPE}
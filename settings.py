@@ -0,0 +1,51 @@
+from router_registry import load_router_configs
+from mac_leases import LEASE_MODES
+from router_expiry import EXPIRY_MODES
+import os
+
+# Configurações comuns ao servidor Flask (liberaçãomikrotik.py) e ao servidor
+# assíncrono (servidor_async.py), lidas das variáveis de ambiente (ver o arquivo
+# env). As de cada servidor (pool de sessões, tempos limite do cliente assíncrono)
+# ficam no próprio servidor.
+
+# Configurações do MikroTik: HOST, PORT, USERNAME e PASSWORD para um roteador só, ou
+# ROUTERS_FILE com a lista de roteadores (ver router_registry.py)
+ROUTER_CONFIGS, ROUTER_MACS, ROUTER_SITES = load_router_configs()
+ROUTER_ENCODING = os.getenv('ROUTER_ENCODING', 'latin-1')  # Codificação dos textos na API (comentários)
+
+# Controle de admissão na frente da API de cada roteador (ver admission.py): tamanho
+# da fila de espera e espera máxima na fila; as operações simultâneas
+# (ADMISSION_MAX_IN_FLIGHT) têm o padrão de cada servidor. Acima disso as
+# requisições recebem 429/503 com Retry-After.
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 1000))
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', 5))
+
+# Persistência das expirações pendentes (sobrevive a reinícios do container)
+EXPIRY_DB_PATH = os.getenv('EXPIRY_DB_PATH', 'expiracoes.db')
+EXPIRY_BATCH_WINDOW = float(os.getenv('EXPIRY_BATCH_WINDOW', 1))  # Expirações próximas são removidas juntas
+EXPIRY_RETRY_DELAY = float(os.getenv('EXPIRY_RETRY_DELAY', 30))   # Nova tentativa após falha na remoção
+# 'app': o serviço remove os MACs vencidos; 'router': um script no MikroTik remove
+# os bindings vencidos (ver router_expiry.py) e o serviço só mantém uma cópia local
+EXPIRY_MODE = os.getenv('EXPIRY_MODE', 'app')
+if EXPIRY_MODE not in EXPIRY_MODES:
+    raise ValueError(f"EXPIRY_MODE deve ser um de {EXPIRY_MODES}, recebido {EXPIRY_MODE!r}")
+EXPIRY_SWEEP_INTERVAL = int(os.getenv('EXPIRY_SWEEP_INTERVAL', 60))  # Intervalo da varredura no roteador
+# Liberar um MAC que já está no IP Binding renova o prazo: 'extend' soma a nova
+# duração ao que resta, 'replace' faz o prazo contar de novo a partir de agora
+LEASE_MODE = os.getenv('LEASE_MODE', 'extend')
+if LEASE_MODE not in LEASE_MODES:
+    raise ValueError(f"LEASE_MODE deve ser um de {LEASE_MODES}, recebido {LEASE_MODE!r}")
+
+# Cópia local do IP Binding de cada roteador, mantida pelo listen do RouterOS em uma
+# sessão dedicada e servida em GET /bindings. Também mantém exato o índice de MACs.
+BINDING_CACHE = os.getenv('BINDING_CACHE', '1') == '1'
+BINDING_HEARTBEAT = float(os.getenv('BINDING_HEARTBEAT', 30))  # Sessão sem mensagens é testada após este tempo
+
+# Tamanho máximo das listas aceitas por /add_macs e /remove_macs
+BATCH_MAX_ENTRIES = int(os.getenv('BATCH_MAX_ENTRIES', 500))
+
+# Mercado Pago: token para consultar pagamentos e segredo para validar o webhook
+MP_ACCESS_TOKEN = os.getenv('MP_ACCESS_TOKEN')
+MP_WEBHOOK_SECRET = os.getenv('MP_WEBHOOK_SECRET')  # Sem segredo, a assinatura não é verificada
+PAYMENT_DB_PATH = os.getenv('PAYMENT_DB_PATH', 'pagamentos.db')  # Fila durável de notificações
+PAYMENT_MAX_ATTEMPTS = int(os.getenv('PAYMENT_MAX_ATTEMPTS', 10))
@@ -0,0 +1,336 @@
+from librouteros.protocol import Encoder, Decoder
+import argparse, itertools, random, socket, socketserver, threading, time
+
+# Simulador local da API do RouterOS (protocolo de sentenças, porta 8728), para
+# testar e medir o serviço sem um roteador de verdade:
+#   python simulador_routeros.py --port 8728 --latency 0.005 --bindings 5000
+#
+# Atende /login, /system/identity/print e print/add/set/remove em qualquer menu
+# (/ip/hotspot/ip-binding e as tabelas de configmikro.py), com filtros ?atributo=valor
+# e comandos com .tag processados em paralelo, como no roteador, além de listen
+# (mudanças enviadas como !re, remoções com .dead=true) e /cancel. Permite injetar
+# latência, erros (!trap) e quedas de conexão, e conta os comandos recebidos.
+
+BINDING_PATH = '/ip/hotspot/ip-binding'
+
+# Atributo que não pode se repetir em cada menu (o RouterOS recusa a entrada duplicada)
+UNIQUE_ATTRIBUTES = {
+    BINDING_PATH: 'mac-address',
+    '/interface/bridge': 'name',
+    '/interface/vlan': 'name',
+    '/ip/pool': 'name',
+    '/ip/dhcp-server': 'name',
+    '/ip/hotspot': 'interface',
+    '/system/script': 'name',
+    '/system/scheduler': 'name',
+}
+
+
+def encode_sentence(words, encoding):
+    data = b''
+    for word in words:
+        encoded = word.encode(encoding)
+        data += Encoder.encodeLength(len(encoded)) + encoded
+    return data + b'\x00'
+
+
+# MAC das entradas pré-carregadas (prefixo 0A, para não colidir com os MACs do benchmark)
+def preloaded_mac(index):
+    value = (0x0A << 40) | index
+    return ':'.join(f'{(value >> shift) & 0xFF:02X}' for shift in range(40, -1, -8))
+
+
+class _Connection(socketserver.BaseRequestHandler):
+    # Respostas e mudanças do listen saem em escritas pequenas e separadas; sem
+    # TCP_NODELAY o Nagle + ACK atrasado do cliente somam dezenas de ms a cada uma,
+    # o que o RouterOS não faz
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _read(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def _read_word(self):
+        first = self._read(1)
+        extra = Decoder.determineLength(first)
+        length = Decoder.decodeLength(first + (self._read(extra) if extra else b''))
+        return self._read(length).decode(self.server.simulator.encoding) if length else ''
+
+    def _read_sentence(self):
+        words = []
+        while True:
+            word = self._read_word()
+            if not word:
+                return words
+            words.append(word)
+
+    def handle(self):
+        simulator = self.server.simulator
+        simulator._count('connections')
+        write_lock = threading.Lock()
+        closed = threading.Event()
+
+        def send(data):
+            with write_lock:
+                if not closed.is_set():
+                    try:
+                        self.request.sendall(data)
+                    except OSError:
+                        closed.set()
+
+        def reply(words):
+            response = simulator.process(words, session=self, send=send)
+            if response is None:
+                # Queda de conexão simulada
+                closed.set()
+                self.request.close()
+                return
+            send(response)
+
+        try:
+            while not closed.is_set():
+                words = self._read_sentence()
+                if not words:
+                    continue
+                if any(word.startswith('.tag=') for word in words):
+                    threading.Thread(target=reply, args=(words,), daemon=True).start()
+                else:
+                    reply(words)
+        except (EOFError, OSError):
+            pass
+        finally:
+            simulator._unsubscribe(self)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class RouterOSSimulator:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, bindings=0,
+                 failure_rate=0.0, disconnect_rate=0.0, seed=None, encoding='latin-1'):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.disconnect_rate = disconnect_rate
+        self.encoding = encoding
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._tables = {}
+        self._stats = {}
+        self._commands = {}
+        self._listeners = {}  # (sessão, tag) -> (menu, palavras da tag, send)
+        self._server = _Server((host, port), _Connection)
+        self._server.simulator = self
+        self._thread = None
+        self.preload(bindings)
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='routeros-sim', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # Pré-carrega a tabela de IP Binding com `count` entradas
+    def preload(self, count):
+        with self._lock:
+            table = self._tables.setdefault(BINDING_PATH, [])
+            for index in range(count):
+                table.append({'.id': self._next_id(), 'mac-address': preloaded_mac(index),
+                              'type': 'bypassed', 'comment': 'Entrada pré-carregada'})
+
+    def table(self, path):
+        with self._lock:
+            return [dict(row) for row in self._tables.get(path, [])]
+
+    def _next_id(self):
+        return f'*{next(self._ids):X}'
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] = self._stats.get(name, 0) + amount
+
+    # Contadores: conexões, logins, comandos (total e por comando), erros e quedas injetados
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['by_command'] = dict(self._commands)
+            stats['bindings'] = len(self._tables.get(BINDING_PATH, []))
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {}
+            self._commands = {}
+
+    # Processa uma sentença e devolve a resposta codificada (None = derrubar a conexão).
+    # listen e /cancel precisam da sessão e da função que escreve nela.
+    def process(self, words, session=None, send=None):
+        command = words[0]
+        tag = [word for word in words if word.startswith('.tag=')]
+        attributes = {}
+        filters = {}
+        for word in words[1:]:
+            if word.startswith('='):
+                name, _, value = word[1:].partition('=')
+                attributes[name] = value
+            elif word.startswith('?'):
+                name, _, value = word[1:].lstrip('=').partition('=')
+                filters[name] = value
+
+        if command == '/login':
+            self._count('logins')
+            return encode_sentence(['!done'] + tag, self.encoding)
+
+        with self._lock:
+            self._stats['commands'] = self._stats.get('commands', 0) + 1
+            self._commands[command] = self._commands.get(command, 0) + 1
+            disconnect = self._random.random() < self.disconnect_rate
+            fail = self._random.random() < self.failure_rate
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+        if delay:
+            time.sleep(delay)
+        if disconnect:
+            self._count('disconnects')
+            return None
+        if fail:
+            self._count('failures')
+            return self._trap(tag, 'falha simulada')
+
+        path, _, operation = command.rpartition('/')
+        if operation == 'listen' and send is not None:
+            # Sem resposta até o /cancel; as mudanças chegam por _notify
+            with self._lock:
+                self._listeners[(session, tuple(tag))] = (path, tag, send)
+            return b''
+        if command == '/cancel':
+            cancelled = [f'.tag={attributes.get("tag", "")}']
+            with self._lock:
+                found = self._listeners.pop((session, tuple(cancelled)), None)
+            response = self._trap(cancelled, 'interrupted') if found else b''
+            return response + self._done(tag)
+        if command == '/system/identity/print':
+            return encode_sentence(['!re'] + tag + ['=name=Simulador'], self.encoding) + \
+                encode_sentence(['!done'] + tag, self.encoding)
+        handler = getattr(self, f'_{operation}', None)
+        if handler is None:
+            return self._trap(tag, 'no such command')
+        return handler(path, attributes, filters, tag)
+
+    def _unsubscribe(self, session):
+        with self._lock:
+            for key in [key for key in self._listeners if key[0] is session]:
+                del self._listeners[key]
+
+    # Envia a mudança de uma entrada às sessões com listen no menu
+    def _notify(self, path, row, dead=False):
+        with self._lock:
+            listeners = [(tag, send) for listen_path, tag, send in self._listeners.values() if listen_path == path]
+        words = [f'={name}={value}' for name, value in row.items()] + (['=.dead=true'] if dead else [])
+        for tag, send in listeners:
+            send(encode_sentence(['!re'] + tag + words, self.encoding))
+
+    def _trap(self, tag, message):
+        self._count('traps')
+        return encode_sentence(['!trap'] + tag + [f'=message={message}'], self.encoding) + \
+            encode_sentence(['!done'] + tag, self.encoding)
+
+    def _done(self, tag, *words):
+        return encode_sentence(['!done'] + tag + list(words), self.encoding)
+
+    def _print(self, path, attributes, filters, tag):
+        with self._lock:
+            rows = [dict(row) for row in self._tables.get(path, [])
+                    if all(row.get(name) == value for name, value in filters.items())]
+        response = b''.join(
+            encode_sentence(['!re'] + tag + [f'={name}={value}' for name, value in row.items()], self.encoding)
+            for row in rows)
+        return response + self._done(tag)
+
+    def _add(self, path, attributes, filters, tag):
+        attributes = dict(attributes)
+        before = attributes.pop('place-before', None)
+        unique = UNIQUE_ATTRIBUTES.get(path)
+        with self._lock:
+            table = self._tables.setdefault(path, [])
+            if unique and unique in attributes and any(row.get(unique) == attributes[unique] for row in table):
+                duplicate = True
+            else:
+                duplicate = False
+                row = {'.id': self._next_id()}
+                row.update(attributes)
+                position = next((i for i, item in enumerate(table) if item['.id'] == before), len(table))
+                table.insert(position, row)
+        if duplicate:
+            return self._trap(tag, 'failure: already have such entry')
+        self._notify(path, row)
+        return self._done(tag, f"=ret={row['.id']}")
+
+    def _set(self, path, attributes, filters, tag):
+        attributes = dict(attributes)
+        item_id = attributes.pop('.id', None)
+        with self._lock:
+            row = next((row for row in self._tables.get(path, []) if row['.id'] == item_id), None)
+            if row is not None:
+                row.update(attributes)
+                row = dict(row)
+        if row is None:
+            return self._trap(tag, 'no such item')
+        self._notify(path, row)
+        return self._done(tag)
+
+    def _remove(self, path, attributes, filters, tag):
+        wanted = attributes.get('.id', '').split(',')
+        with self._lock:
+            table = self._tables.get(path, [])
+            existing = {row['.id'] for row in table}
+            missing = [item_id for item_id in wanted if item_id not in existing]
+            if not missing:
+                removed = [row for row in table if row['.id'] in wanted]
+                table[:] = [row for row in table if row['.id'] not in wanted]
+        if missing:
+            return self._trap(tag, 'no such item')
+        for row in removed:
+            self._notify(path, {'.id': row['.id']}, dead=True)
+        return self._done(tag)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulador local da API do RouterOS')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8728)
+    parser.add_argument('--latency', type=float, default=0.0, help='Atraso por comando, em segundos')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Atraso adicional aleatório, em segundos')
+    parser.add_argument('--bindings', type=int, default=0, help='Entradas pré-carregadas no IP Binding')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fração de comandos respondidos com !trap')
+    parser.add_argument('--disconnect-rate', type=float, default=0.0, help='Fração de comandos que derrubam a conexão')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    simulator = RouterOSSimulator(
+        args.host, args.port, latency=args.latency, jitter=args.jitter, bindings=args.bindings,
+        failure_rate=args.failure_rate, disconnect_rate=args.disconnect_rate, seed=args.seed,
+    ).start()
+    print(f"Simulador RouterOS em {args.host}:{simulator.address[1]}")
+    try:
+        while True:
+            time.sleep(60)
+            print(simulator.stats())
+    except KeyboardInterrupt:
+        simulator.stop()
@@ -0,0 +1,283 @@
+from urllib import request as urlrequest, error as urlerror
+import threading, sqlite3, time, os, json, hmac, hashlib, logging
+
+from binding_index import normalize_mac
+from metrics import ERRORS
+
+log = logging.getLogger(__name__)
+
+MERCADOPAGO_API = 'https://api.mercadopago.com'
+
+# Ações de notificação que podem indicar um pagamento aprovado
+PAYMENT_ACTIONS = ('payment.created', 'payment.updated')
+
+
+# Valida o cabeçalho x-signature enviado pelo Mercado Pago ("ts=...,v1=...").
+# O manifesto assinado é "id:<data.id>;request-id:<x-request-id>;ts:<ts>;".
+def verify_signature(secret, signature_header, request_id, data_id):
+    if not signature_header:
+        return False
+    parts = dict(part.strip().split('=', 1) for part in signature_header.split(',') if '=' in part)
+    ts, received = parts.get('ts'), parts.get('v1')
+    if not ts or not received:
+        return False
+    manifest = ''
+    if data_id:
+        data_id = str(data_id)
+        manifest += f'id:{data_id.lower() if data_id.isalnum() else data_id};'
+    if request_id:
+        manifest += f'request-id:{request_id};'
+    manifest += f'ts:{ts};'
+    expected = hmac.new(secret.encode(), manifest.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, received)
+
+
+# Busca o pagamento na API do Mercado Pago. Retorna o JSON do pagamento ou None (404).
+def fetch_mercadopago_payment(payment_id, access_token, timeout=10):
+    req = urlrequest.Request(f'{MERCADOPAGO_API}/v1/payments/{payment_id}',
+                             headers={'Authorization': f'Bearer {access_token}'})
+    try:
+        with urlrequest.urlopen(req, timeout=timeout) as response:
+            return json.loads(response.read().decode())
+    except urlerror.HTTPError as e:
+        if e.code == 404:
+            return None
+        raise
+
+
+# Extrai do pagamento aprovado o MAC e a duração do acesso, gravados pelo checkout
+# em metadata ({"mac_address": "...", "duration": 3600}).
+# Retorna (mac, duração, motivo); motivo explica por que não há o que liberar.
+def payment_release_request(payment):
+    if not payment:
+        return None, None, "Pagamento não encontrado"
+    if payment.get('status') != 'approved':
+        return None, None, f"Pagamento com status {payment.get('status')}"
+    metadata = payment.get('metadata') or {}
+    try:
+        mac_address = normalize_mac(metadata.get('mac_address'))
+        duration = int(metadata.get('duration'))
+    except (TypeError, ValueError):
+        return None, None, "Pagamento sem mac_address/duration válidos em metadata"
+    if duration <= 0:
+        return None, None, "Pagamento com duration inválida"
+    return mac_address, duration, None
+
+
+# Armazenamento durável (SQLite WAL) das notificações recebidas e das liberações.
+# Notificações são únicas por (payment_id, action); liberações são únicas por
+# payment_id e guardam o prazo alvo da liberação, o que garante no máximo uma
+# liberação aplicada por pagamento.
+class PaymentEventStore:
+    def __init__(self, path, claim_timeout=120):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS payment_events (
+                payment_id TEXT NOT NULL,
+                action TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                received_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (payment_id, action)
+            );
+            CREATE INDEX IF NOT EXISTS payment_events_pending
+                ON payment_events (status, next_attempt_at);
+            CREATE TABLE IF NOT EXISTS payment_releases (
+                payment_id TEXT PRIMARY KEY,
+                mac_address TEXT NOT NULL,
+                duration INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                expires_at REAL
+            );
+        ''')
+        columns = [row[1] for row in self._db.execute('PRAGMA table_info(payment_releases)')]
+        if 'expires_at' not in columns:
+            self._db.execute('ALTER TABLE payment_releases ADD COLUMN expires_at REAL')
+        # Eventos em processamento há mais de `claim_timeout` segundos (o processo que os
+        # retirou parou) voltam a ser retirados por claim. Não são devolvidos à fila aqui:
+        # outro processo com a mesma fila pode estar processando-os agora.
+        self.claim_timeout = claim_timeout
+
+    # Registra a notificação. Retorna True se ela entrou na fila agora. Uma entrega
+    # repetida é ignorada, exceto quando o evento anterior terminou sem liberar
+    # (pagamento ainda não aprovado): aí ele volta para a fila.
+    def record(self, payment_id, action):
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO payment_events (payment_id, action, status, next_attempt_at, received_at, updated_at) "
+                "VALUES (?, ?, 'pending', ?, ?, ?) "
+                "ON CONFLICT(payment_id, action) DO UPDATE SET status = 'pending', attempts = 0, "
+                "next_attempt_at = excluded.next_attempt_at, updated_at = excluded.updated_at "
+                "WHERE payment_events.status = 'ignored'",
+                (str(payment_id), action, now, now, now))
+            return cursor.rowcount > 0
+
+    # Retira o próximo evento vencido da fila (ou abandonado em processamento),
+    # marcando-o como em processamento. A leitura e a marcação ficam em uma transação
+    # com o banco travado para escrita (BEGIN IMMEDIATE): o lock da instância só vale
+    # dentro do processo e dois processos com a mesma fila poderiam retirar o mesmo evento.
+    def claim(self):
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute(
+                    "SELECT payment_id, action, attempts FROM payment_events "
+                    "WHERE (status = 'pending' AND next_attempt_at <= ?) "
+                    "OR (status = 'processing' AND updated_at <= ?) "
+                    "ORDER BY next_attempt_at LIMIT 1", (now, now - self.claim_timeout)).fetchone()
+                if row:
+                    self._db.execute(
+                        "UPDATE payment_events SET status = 'processing', attempts = attempts + 1, updated_at = ? "
+                        "WHERE payment_id = ? AND action = ?", (now, row[0], row[1]))
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+            return row
+
+    def next_due(self):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(next_attempt_at) FROM payment_events WHERE status = 'pending'").fetchone()
+            return row[0]
+
+    # Finaliza o evento: 'done' (liberado), 'ignored' (nada a liberar) ou 'failed'
+    def finish(self, payment_id, action, status, error=None):
+        with self._lock:
+            self._db.execute(
+                "UPDATE payment_events SET status = ?, last_error = ?, updated_at = ? "
+                "WHERE payment_id = ? AND action = ?",
+                (status, error, time.time(), payment_id, action))
+
+    def retry(self, payment_id, action, retry_at, error):
+        with self._lock:
+            self._db.execute(
+                "UPDATE payment_events SET status = 'pending', next_attempt_at = ?, last_error = ?, updated_at = ? "
+                "WHERE payment_id = ? AND action = ?",
+                (retry_at, error, time.time(), payment_id, action))
+
+    # Retorna (status, prazo alvo) da liberação do pagamento, ou (None, None)
+    def release_status(self, payment_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, expires_at FROM payment_releases WHERE payment_id = ?", (payment_id,)).fetchone()
+            return tuple(row) if row else (None, None)
+
+    # Marca a liberação como iniciada ('releasing', com o prazo alvo gravado antes da
+    # escrita no roteador) ou concluída ('released')
+    def set_release(self, payment_id, mac_address, duration, status, expires_at=None):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO payment_releases (payment_id, mac_address, duration, status, updated_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(payment_id) DO UPDATE SET "
+                "status = excluded.status, updated_at = excluded.updated_at, "
+                "expires_at = COALESCE(excluded.expires_at, payment_releases.expires_at)",
+                (payment_id, mac_address, duration, status, time.time(), expires_at))
+
+    def counts(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT status, COUNT(*) FROM payment_events GROUP BY status").fetchall()
+        return dict(rows)
+
+
+# Worker em segundo plano que consome a fila de notificações: busca o pagamento,
+# descobre o MAC e a duração e chama `release(mac, duração, on_lease)` -> (sucesso,
+# mensagem), que chama `on_lease(prazo)` antes de escrever no roteador. Se uma
+# tentativa anterior foi interrompida depois disso, compara o prazo alvo gravado com
+# `current_expiry(mac)` (prazo vigente do MAC, ou None) antes de liberar de novo:
+# com renovação, o MAC já estar no IP Binding não diz se este pagamento foi aplicado.
+class PaymentWorker:
+    def __init__(self, store, fetch_payment, release, current_expiry, retry_base=30,
+                 retry_max=1800, max_attempts=10, poll_interval=5):
+        self.store = store
+        self.fetch_payment = fetch_payment
+        self.release = release
+        self.current_expiry = current_expiry
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='payment-worker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    # Chamado pelo webhook depois de registrar um evento novo
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped:
+            event = self.store.claim()
+            if event is None:
+                next_due = self.store.next_due()
+                wait = self.poll_interval if next_due is None else min(
+                    self.poll_interval, max(0.0, next_due - time.time()))
+                self._wakeup.wait(wait)
+                self._wakeup.clear()
+                continue
+            payment_id, action, attempts = event
+            try:
+                status, message = self.process(payment_id)
+                self.store.finish(payment_id, action, status, message)
+                log.info(message, extra={'payment_id': payment_id, 'action': action, 'status': status})
+            except Exception as e:
+                if attempts + 1 >= self.max_attempts:
+                    self.store.finish(payment_id, action, 'failed', str(e))
+                    ERRORS.inc(kind='payment_failed')
+                    log.error("Pagamento falhou definitivamente", extra={'payment_id': payment_id, 'action': action, 'error': str(e)})
+                else:
+                    delay = min(self.retry_max, self.retry_base * (2 ** attempts))
+                    self.store.retry(payment_id, action, time.time() + delay, str(e))
+                    ERRORS.inc(kind='payment_retry')
+                    log.warning("Erro ao processar pagamento, nova tentativa agendada", extra={'payment_id': payment_id, 'action': action, 'retry_in': delay, 'error': str(e)})
+
+    # Processa um pagamento. Retorna (status do evento, mensagem); lança exceção
+    # quando vale tentar de novo.
+    def process(self, payment_id):
+        release_status, target = self.store.release_status(payment_id)
+        if release_status == 'released':
+            return 'done', "Acesso já liberado para este pagamento"
+
+        mac_address, duration, reason = payment_release_request(self.fetch_payment(payment_id))
+        if reason:
+            return 'ignored', reason
+
+        if release_status == 'releasing' and target is not None:
+            # Tentativa anterior escreveu no roteador mas não chegou a registrar: o
+            # prazo vigente já alcança o alvo (o comentário guarda só os segundos inteiros)
+            current = self.current_expiry(mac_address)
+            if current is not None and current >= int(target):
+                self.store.set_release(payment_id, mac_address, duration, 'released')
+                return 'done', f"MAC {mac_address} já estava liberado"
+
+        def on_lease(expires_at):
+            self.store.set_release(payment_id, mac_address, duration, 'releasing', expires_at)
+
+        success, message = self.release(mac_address, duration, on_lease)
+        if not success:
+            raise RuntimeError(message)
+        self.store.set_release(payment_id, mac_address, duration, 'released')
+        return 'done', message